@@ -1,27 +1,567 @@
-from flask import Flask, request, abort, jsonify
+import base64
+import binascii
+import datetime
+import hashlib
+import os
+from functools import partial
+from itertools import chain
+from urllib.parse import urlencode
+
+from flask import Flask, Response, request, abort, jsonify, json
+from flask import current_app, g, stream_with_context
 from flask_cors import CORS
 
-from models import setup_db, Movie, Actor
+from models import setup_db, db, row_version, detail_version, Movie, Actor
+from models import database_path, replica_paths, unit_of_work, ids_condition
+
+from auth import AuthError, requires_auth, check_permissions, jwks_store
+from cache import response_cache, conditional
+from compression import compression
+from bulk import MAX_BULK_SIZE, bulk_write_movies, bulk_write_actors, is_int
+from metrics import METRICS_ENABLED, registry, init_app as init_metrics
+from metrics import profiled
+from replicas import replica_reads
+from serializers import JSONEncoder, row_serializer
+
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 1000))
+MAX_IDS = int(os.environ.get('MAX_IDS', 500))
+# range of the Integer columns ids and filters are compared with
+MIN_INT, MAX_INT = -2 ** 31, 2 ** 31 - 1
+
+
+'''
+encode_cursor(last_id) / decode_cursor(cursor)
+    opaque keyset cursors for paginated listings, a plain id is accepted too
+'''
+
+
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def is_digits(value):
+    # str.isdigit() is true for digits int() can't parse, like '²'
+    return value.isascii() and value.isdigit()
+
+
+def in_int_range(value):
+    # larger values make the driver raise instead of matching no row
+    if not MIN_INT <= value <= MAX_INT:
+        abort(400)
+    return value
+
+
+def decode_cursor(cursor):
+    if is_digits(cursor):
+        return in_int_range(int(cursor))
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        last_id = int(json.loads(raw.decode('utf-8'))['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError, OverflowError):
+        abort(400)
+    return in_int_range(last_id)
+
+
+def get_page_args():
+    after = request.args.get('after', None)
+    limit = request.args.get('limit', None)
+    if after is not None:
+        after = decode_cursor(after)
+    if limit is not None:
+        if not is_digits(limit) or not 0 < int(limit) <= MAX_PAGE_SIZE:
+            abort(400)
+        limit = int(limit)
+    return after, limit
+
+
+def get_fields(model):
+    fields = request.args.get('fields', None)
+    if fields is None:
+        return None
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    if not fields or any(field not in model.fields for field in fields):
+        abort(400)
+    return fields
+
+
+def get_filters(model):
+    filters = {}
+    for name, kind in model.filters.items():
+        value = request.args.get(name, None)
+        if value is None:
+            continue
+        try:
+            if kind is datetime.date:
+                value = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            else:
+                value = kind(value)
+        except ValueError:
+            abort(400)
+        if kind is int:
+            in_int_range(value)
+        filters[name] = value
+    return filters
+
+
+def list_columns(model, fields):
+    return ['id'] + [field for field in fields
+                     if field in model.__table__.columns and field != 'id']
+
+
+'''
+list_query(model, fields, after)
+    the Core SELECT of a listing over the listed columns; the filters are
+    applied to an ORM query, but only the statement it compiles to is
+    executed, so rows come back as plain column tuples
+'''
+
+
+def list_query(model, fields, after):
+    query = db.session.query(*[
+        getattr(model, column)
+        for column in list_columns(model, fields or model.fields)])
+    query = model.apply_filters(query, get_filters(model))
+    query = query.order_by(model.id)
+    if after is not None:
+        query = query.filter(model.id > after)
+    return query.statement
+
+
+'''
+serialize_rows(model, rows, fields, ids=None)
+    the JSON of each row as format() / format_rows() would produce it,
+    encoded straight from the column values of list_query(); related ids
+    are looked up for `ids` (a list or a SELECT of ids), the rows' ids by
+    default
+'''
+
+
+def serialize_rows(model, rows, fields, ids=None):
+    fields = tuple(fields or model.fields)
+    serialize = row_serializer(model, fields,
+                               tuple(list_columns(model, fields)),
+                               current_app.config['JSON_SORT_KEYS'])
+    related = None
+    if serialize.related:
+        related = Movie.actor_ids_by_movie(
+            [row[0] for row in rows] if ids is None else ids)
+    with profiled('serialize'):
+        return [serialize(row, related) for row in rows]
+
+
+'''
+list_resources(model)
+    one page of model rows ordered by id as JSON texts, honouring ?after,
+    ?limit and ?fields; only the listed columns are loaded
+'''
+
+
+def list_resources(model):
+    after, limit = get_page_args()
+    fields = get_fields(model)
+
+    statement = list_query(model, fields, after)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    rows = db.session.execute(statement).fetchall()
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id)
+
+    if rows == [] and after is None:
+        abort(404)
+    # the casts are looked up through the listing's own ids, a long page
+    # would otherwise send one bound parameter per row
+    ids = statement.with_only_columns([model.id])
+    return serialize_rows(model, rows, fields, ids), next_cursor
+
+
+'''
+list_response(model, key)
+    the listing response, assembled from the serialized rows into the
+    same body jsonify would send
+'''
+
+
+def list_response(model, key):
+    items, next_cursor = list_resources(model)
+    members = {key: '[' + ','.join(items) + ']', 'success': 'true'}
+    if 'limit' in request.args or 'after' in request.args:
+        members['next_cursor'] = json.dumps(next_cursor)
+    return json_response(members)
+
+
+def json_response(members):
+    names = list(members)
+    if current_app.config['JSON_SORT_KEYS']:
+        names.sort()
+    body = '{' + ','.join('"%s":%s' % (name, members[name])
+                          for name in names) + '}\n'
+    return current_app.response_class(
+        body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+
+'''
+get_ids()
+    the ids of ?ids=3,1,2 in request order without repeats, at most
+    MAX_IDS; only ?fields goes along with them
+'''
+
+
+def get_ids():
+    values = [value.strip() for value in request.args['ids'].split(',')
+              if value.strip()]
+    if (not values or len(values) > MAX_IDS
+            or not all(is_digits(value) for value in values)
+            or set(request.args) - {'ids', 'fields'}):
+        abort(400)
+    return list(dict.fromkeys(in_int_range(int(value)) for value in values))
+
+
+'''
+ids_query(model, fields, ids) / ids_response(model, key)
+    the SELECT of the listed columns of the given ids, and the rows of
+    ?ids in request order, fetched in one query and serialized like the
+    listing, with the requested ids that don't exist as `missing`
+'''
+
+
+def ids_query(model, fields, ids):
+    return db.session.query(*[
+        getattr(model, column)
+        for column in list_columns(model, fields or model.fields)]).filter(
+        ids_condition(model, ids)).statement
+
+
+def ids_response(model, key):
+    ids = get_ids()
+    fields = get_fields(model)
+    statement = ids_query(model, fields, ids)
+    rows = {row.id: row for row in db.session.execute(statement)}
+    found = [rows[resource_id] for resource_id in ids if resource_id in rows]
+    items = serialize_rows(model, found, fields,
+                           statement.with_only_columns([model.id]))
+    missing = [resource_id for resource_id in ids if resource_id not in rows]
+    return json_response({key: '[' + ','.join(items) + ']',
+                          'missing': json.dumps(missing),
+                          'success': 'true'})
+
+
+'''
+list_version(model) / list_validator(model)
+    the table-wide row version, read once per request, and the etag of a
+    listing derived from it and the query arguments. Listings get no
+    Last-Modified, there is no timestamp that every write moves
+'''
+
+
+def list_version(model):
+    if 'list_version' not in g:
+        g.list_version = '.'.join(map(str, row_version(model)))
+    return g.list_version
+
+
+def list_validator(model):
+    def validator():
+        args = urlencode(sorted(request.args.items(multi=True)))
+        digest = hashlib.sha1(args.encode('utf-8')).hexdigest()[:16]
+        return f'{model.__tablename__}-{list_version(model)}-{digest}', None
+    return validator
+
+
+def get_include(relation):
+    include = request.args.get('include', None)
+    if include not in (None, relation):
+        abort(400)
+    return include is not None
+
+
+'''
+detail_validator(model, related, relation)
+    etag and Last-Modified of a single resource; with ?include=<relation>
+    the etag also covers the related rows and Last-Modified is left out
+    since removing a related row doesn't move any updated_at
+
+    The etag starts with the resource's version tag, which PATCH accepts in
+    If-Match.
+'''
+
+
+def detail_validator(model, related, relation):
+    def validator():
+        if 'detail_validator' not in g:
+            g.detail_validator = compute_validator()
+        return g.detail_validator
+
+    def compute_validator():
+        resource_id = next(iter(request.view_args.values()))
+        include = get_include(relation)
+        version = detail_version(model, resource_id,
+                                 related if include else None)
+        if version is None:
+            abort(404)
+        updated_at, row_version, related_version = version
+        etag = version_tag(model, resource_id, row_version)
+        if related_version is None:
+            return etag, updated_at
+        count, latest = related_version
+        latest = latest.isoformat() if latest else 0
+        return f'{etag}-{relation}.{count}.{latest}', None
+    return validator
+
+
+def version_tag(model, resource_id, version):
+    return f'{model.__tablename__}-{resource_id}-v{version}'
+
+
+'''
+get_if_match(model, resource_id)
+    the row versions If-Match allows, None without the header or for
+    If-Match: *; weak tags count too, the version in a tag changes with
+    every write of the row whichever way it is compared
+'''
+
+
+def get_if_match(model, resource_id):
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = version_tag(model, resource_id, '')
+    versions = [tag[len(prefix):].split('-')[0] for tag in
+                request.if_match.as_set(include_weak=True)
+                if tag.startswith(prefix)]
+    return [int(version) for version in versions if is_digits(version)]
+
+
+def patch_failed(model, resource_id, versions):
+    '''
+    the status of a PATCH whose UPDATE matched no row: 412 when the row
+    exists in another version than If-Match asked for, 404 otherwise
+    '''
+    if versions is not None and db.session.query(model.id).filter(
+            model.id == resource_id).first() is not None:
+        return 412
+    return 404
+
+
+def patch_response(model, key, row, resource):
+    response = write_response(model, key, row.id, resource)
+    response.set_etag(version_tag(model, row.id, row.version))
+    return response
+
 
-from auth import AuthError, requires_auth
+def detail_namespace(name):
+    return lambda: f'{name}:{next(iter(request.view_args.values()))}'
+
+
+def is_streamed():
+    return get_stream_format() is not None
+
+
+def get_stream_format():
+    stream = request.args.get('stream', None)
+    if stream is None:
+        if request.accept_mimetypes.best == 'application/x-ndjson':
+            return 'ndjson'
+        return None
+    if stream not in ('json', 'ndjson'):
+        abort(400)
+    return stream
+
+
+def iter_batches(statement, size):
+    result = db.session.execute(
+        statement.execution_options(stream_results=True))
+    while True:
+        batch = result.fetchmany(size)
+        if batch == []:
+            return
+        yield batch
+
+
+'''
+stream_resources(model, key, stream_format)
+    the whole listing as a streamed response, read through a server-side
+    cursor in batches of STREAM_BATCH_SIZE rows so memory stays flat;
+    `json` keeps the usual envelope, `ndjson` emits one resource per line;
+    ?limit is rejected rather than ignored
+'''
+
+
+def stream_resources(model, key, stream_format):
+    after, limit = get_page_args()
+    if limit is not None:
+        abort(400)
+    fields = get_fields(model)
+
+    batches = iter_batches(list_query(model, fields, after),
+                           STREAM_BATCH_SIZE)
+    first_batch = next(batches, [])
+    if first_batch == [] and after is None:
+        abort(404)
+
+    def generate_batches():
+        for batch in chain([first_batch], batches):
+            yield serialize_rows(model, batch, fields)
+
+    def generate_ndjson():
+        for items in generate_batches():
+            yield '\n'.join(items) + '\n'
+
+    def generate_json():
+        yield '{"%s":[' % key
+        separator = ''
+        for items in generate_batches():
+            yield separator + ','.join(items)
+            separator = ','
+        yield '],"success":true}\n'
+
+    if stream_format == 'ndjson':
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype='application/x-ndjson')
+    return Response(stream_with_context(generate_json()),
+                    mimetype='application/json')
+
+
+'''
+wants_minimal_response()
+    whether a write asked for just the affected resource, either with
+    `Prefer: return=minimal` or `?return=minimal`
+'''
+
+
+def wants_minimal_response():
+    if request.args.get('return', None) == 'minimal':
+        return True
+    prefer = request.headers.get('Prefer', '')
+    return 'return=minimal' in [part.strip() for part in prefer.split(',')]
+
+
+def write_response(model, key, resource_id, resource=None):
+    if wants_minimal_response():
+        response = {
+            "success": True,
+            "id": resource_id
+        }
+        if resource is not None:
+            response[key[:-1]] = resource
+        response = jsonify(response)
+        response.headers['Preference-Applied'] = 'return=minimal'
+        return response
+
+    rows = model.query.order_by(model.id).all()
+    return jsonify({
+        "success": True,
+        key: model.format_all(rows)
+    })
+
+
+def parse_release_date(value):
+    '''
+    YYYY-MM-DD strings as dates so every database accepts them; anything
+    else is left to the database to parse or reject
+    '''
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    return value
+
+
+def parse_age(value):
+    '''
+    numeric strings as integers, the way Postgres casts them; other strings
+    raise ValueError rather than being stored as text by sqlite
+    '''
+    if isinstance(value, str):
+        return int(value)
+    return value
+
+
+def get_bulk_records():
+    records = request.get_json()
+    if not isinstance(records, list) or not 0 < len(records) <= MAX_BULK_SIZE:
+        abort(400)
+    return records
+
+
+def bulk_response(results):
+    statuses = [result['status'] for result in results]
+    return jsonify({
+        "success": True,
+        "created": statuses.count('created'),
+        "updated": statuses.count('updated'),
+        "failed": len(statuses) - statuses.count('created') -
+        statuses.count('updated'),
+        "results": results
+    })
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    app.config.from_mapping(test_config or {})
+    setup_db(app, app.config.get('SQLALCHEMY_DATABASE_URI', database_path),
+             app.config.get('SQLALCHEMY_REPLICA_URIS', replica_paths))
     CORS(app)
+    # before init_metrics, which wraps the app's encoder
+    app.json_encoder = JSONEncoder
+    # registered before the other after_request functions, so it runs
+    # last and compresses the final body
+    compression.init_app(app)
+
+    # started with the first request rather than at import, so a server
+    # that forks workers after loading the app starts it in every worker
+    @app.before_first_request
+    def start_jwks_refresh():
+        jwks_store.start_background_refresh()
+
+    if METRICS_ENABLED:
+        init_metrics(app)
+
+        @app.route('/metrics')
+        def get_metrics():
+            return Response(registry.render(),
+                            mimetype='text/plain; version=0.0.4')
+
+    # after_request functions run in reverse order: the commit runs before
+    # the profile is finished and before the replica router records the
+    # write
+    unit_of_work.init_app(app)
 
     @app.route('/movies')
     @requires_auth('get:movies')
+    @replica_reads
+    @conditional(list_validator(Movie), bypass=is_streamed)
+    @response_cache.cached('movies', bypass=is_streamed,
+                           version=partial(list_version, Movie))
     def get_movies(token):
-        movies = Movie.query.order_by(Movie.id).all()
-        if movies == []:
+        if 'ids' in request.args:
+            return ids_response(Movie, 'movies')
+        stream_format = get_stream_format()
+        if stream_format is not None:
+            return stream_resources(Movie, 'movies', stream_format)
+        return list_response(Movie, 'movies')
+
+    movie_validator = detail_validator(Movie, Actor, 'actors')
+
+    @app.route('/movies/<int:movie_id>')
+    @requires_auth('get:movies')
+    @replica_reads
+    @conditional(movie_validator)
+    @response_cache.cached(detail_namespace('movie'),
+                           version=lambda: movie_validator()[0])
+    def get_movie(token, movie_id):
+        movie = Movie.get_detail(movie_id, get_include('actors'))
+        if movie is None:
             abort(404)
-        formatted_movies = [movie.format() for movie in movies]
         return jsonify({
             "success": True,
-            "movies": formatted_movies
+            "movie": movie
         })
 
     @app.route('/movies', methods=["POST"])
@@ -30,7 +570,7 @@ def create_app(test_config=None):
         body = request.get_json()
 
         new_title = body.get('title', None)
-        new_release_date = body.get('release_date', None)
+        new_release_date = parse_release_date(body.get('release_date', None))
         new_actors = Actor.query.filter(Actor.id.in_(
             body.get('actors', None))).all()
 
@@ -40,36 +580,77 @@ def create_app(test_config=None):
                           )
             movie.actors = new_actors
             movie.insert()
-            movies = Movie.query.order_by(Movie.id).all()
-            formatted_movies = [movie.format() for movie in movies]
-            return jsonify({
-                "success": True,
-                "movies": formatted_movies
-            })
+            return write_response(Movie, 'movies', movie.id, movie.format())
+        except Exception:
+            abort(422)
+
+    @app.route('/movies/bulk', methods=["POST"])
+    @requires_auth('post:movies')
+    def bulk_movies(token):
+        records = get_bulk_records()
+        if any(isinstance(record, dict) and 'id' in record
+               for record in records):
+            check_permissions('patch:movies', token)
+
+        try:
+            results = bulk_write_movies(records)
         except Exception:
+            db.session.rollback()
             abort(422)
+        unit_of_work.invalidate(*[f'movie:{result["id"]}'
+                                  for result in results
+                                  if result['status'] == 'updated'])
+        return bulk_response(results)
 
     @app.route('/movies/<int:movie_id>', methods=["PATCH"])
     @requires_auth('patch:movies')
     def edit_movie(token, movie_id):
         body = request.get_json()
+        versions = get_if_match(Movie, movie_id)
+
+        try:
+            row = Movie.patch(movie_id, {
+                'title': body.get('title', None),
+                'release_date': parse_release_date(
+                    body.get('release_date', None))
+            }, [actor_id for actor_id, in db.session.query(
+                Actor.id).filter(Actor.id.in_(body.get('actors', None)))],
+                versions)
+        except Exception:
+            abort(422)
+        if row is None:
+            abort(patch_failed(Movie, movie_id, versions))
+
+        unit_of_work.invalidate(f'movie:{movie_id}')
+        actor_ids = Movie.actor_ids_by_movie([movie_id]).get(movie_id, [])
+        return patch_response(Movie, 'movies', row,
+                              Movie.format(row, actor_ids))
+
+    @app.route('/movies/<int:movie_id>/actors', methods=["PATCH"])
+    @requires_auth('patch:movies')
+    def edit_movie_actors(token, movie_id):
+        body = request.get_json()
 
         movie = Movie.query.filter(Movie.id == movie_id).one_or_none()
         if movie is None:
             abort(404)
 
+        add = body.get('add', []) if isinstance(body, dict) else None
+        remove = body.get('remove', []) if isinstance(body, dict) else None
+        if not all(isinstance(ids, list) and all(map(is_int, ids))
+                   for ids in (add, remove)):
+            abort(400)
+        if set(add) & set(remove):
+            abort(422)
+        if len(set(add)) != db.session.query(Actor.id).filter(
+                Actor.id.in_(add)).count():
+            abort(422)
+
         try:
-            movie.title = body.get('title', None)
-            movie.release_date = body.get('release_date', None)
-            movie.actors = Actor.query.filter(Actor.id.in_(
-                body.get('actors', None))).all()
+            movie.change_actors(add, remove)
             movie.update()
-            movies = Movie.query.order_by(Movie.id).all()
-            formatted_movies = [movie.format() for movie in movies]
-            return jsonify({
-                "success": True,
-                "movies": formatted_movies
-            })
+            unit_of_work.invalidate(f'movie:{movie_id}')
+            return write_response(Movie, 'movies', movie.id, movie.format())
         except Exception:
             abort(422)
 
@@ -81,25 +662,40 @@ def create_app(test_config=None):
             abort(404)
         try:
             movie.delete()
-            movies = Movie.query.order_by(Movie.id).all()
-            formatted_movies = [movie.format() for movie in movies]
-            return jsonify({
-                "success": True,
-                "movies": formatted_movies
-            })
+            unit_of_work.invalidate(f'movie:{movie_id}')
+            return write_response(Movie, 'movies', movie_id)
         except Exception:
             abort(422)
 
     @app.route('/actors')
     @requires_auth('get:actors')
+    @replica_reads
+    @conditional(list_validator(Actor), bypass=is_streamed)
+    @response_cache.cached('actors', bypass=is_streamed,
+                           version=partial(list_version, Actor))
     def get_actors(token):
-        actors = Actor.query.order_by(Actor.id).all()
-        if actors == []:
+        if 'ids' in request.args:
+            return ids_response(Actor, 'actors')
+        stream_format = get_stream_format()
+        if stream_format is not None:
+            return stream_resources(Actor, 'actors', stream_format)
+        return list_response(Actor, 'actors')
+
+    actor_validator = detail_validator(Actor, Movie, 'movies')
+
+    @app.route('/actors/<int:actor_id>')
+    @requires_auth('get:actors')
+    @replica_reads
+    @conditional(actor_validator)
+    @response_cache.cached(detail_namespace('actor'),
+                           version=lambda: actor_validator()[0])
+    def get_actor(token, actor_id):
+        actor = Actor.get_detail(actor_id, get_include('movies'))
+        if actor is None:
             abort(404)
-        formatted_actors = [actor.format() for actor in actors]
         return jsonify({
             "success": True,
-            "actors": formatted_actors
+            "actor": actor
         })
 
     @app.route('/actors', methods=["POST"])
@@ -112,40 +708,51 @@ def create_app(test_config=None):
         new_age = body.get('age', None)
 
         try:
+            new_age = parse_age(new_age)
             actor = Actor(name=new_name,
                           gender=new_gender, age=new_age)
             actor.insert()
-            actors = Actor.query.order_by(Actor.id).all()
-            formatted_actors = [actor.format() for actor in actors]
-            return jsonify({
-                "success": True,
-                "actors": formatted_actors
-            })
+            return write_response(Actor, 'actors', actor.id, actor.format())
+        except Exception:
+            abort(422)
+
+    @app.route('/actors/bulk', methods=["POST"])
+    @requires_auth('post:actors')
+    def bulk_actors(token):
+        records = get_bulk_records()
+        if any(isinstance(record, dict) and 'id' in record
+               for record in records):
+            check_permissions('patch:actors', token)
+
+        try:
+            results = bulk_write_actors(records)
         except Exception:
+            db.session.rollback()
             abort(422)
+        unit_of_work.invalidate(*[f'actor:{result["id"]}'
+                                  for result in results
+                                  if result['status'] == 'updated'])
+        return bulk_response(results)
 
     @app.route('/actors/<int:actor_id>', methods=["PATCH"])
     @requires_auth('patch:actors')
     def edit_actor(token, actor_id):
-        actor = Actor.query.filter(Actor.id == actor_id).one_or_none()
-        if actor is None:
-            abort(404)
-
         body = request.get_json()
+        versions = get_if_match(Actor, actor_id)
 
         try:
-            actor.name = body.get('name', None)
-            actor.gender = body.get('gender', None)
-            actor.age = body.get('age', None)
-            actor.update()
-            actors = Actor.query.order_by(Actor.id).all()
-            formatted_actors = [actor.format() for actor in actors]
-            return jsonify({
-                "success": True,
-                "actors": formatted_actors
-            })
+            row = Actor.patch(actor_id, {
+                'name': body.get('name', None),
+                'gender': body.get('gender', None),
+                'age': parse_age(body.get('age', None))
+            }, versions)
         except Exception:
             abort(422)
+        if row is None:
+            abort(patch_failed(Actor, actor_id, versions))
+
+        unit_of_work.invalidate(f'actor:{actor_id}')
+        return patch_response(Actor, 'actors', row, Actor.format(row))
 
     @app.route('/actors/<int:actor_id>', methods=["DELETE"])
     @requires_auth('delete:actors')
@@ -155,12 +762,8 @@ def create_app(test_config=None):
             abort(404)
         try:
             actor.delete()
-            actors = Actor.query.order_by(Actor.id).all()
-            formatted_actors = [actor.format() for actor in actors]
-            return jsonify({
-                "success": True,
-                "actors": formatted_actors
-            })
+            unit_of_work.invalidate(f'actor:{actor_id}')
+            return write_response(Actor, 'actors', actor_id)
         except Exception:
             abort(422)
 
@@ -196,6 +799,14 @@ def create_app(test_config=None):
             "message": "Method not found"
         }), 405
 
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return jsonify({
+            'success': False,
+            "error": 412,
+            "message": "Precondition failed"
+        }), 412
+
     @app.errorhandler(500)
     def server_error(error):
         return jsonify({
@@ -213,7 +824,20 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
+'''
+app
+    built on first access (flask run, manage.py), so importing this
+    module for create_app doesn't need DATABASE_URL; gunicorn is started
+    with the factory, gunicorn 'app:create_app()'
+'''
+
+
+def __getattr__(name):
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 if __name__ == '__main__':
-    APP.run(host='0.0.0.0', port=8080, debug=True)
+    create_app().run(host='0.0.0.0', port=8080, debug=True)
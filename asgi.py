@@ -0,0 +1,324 @@
+'''
+asgi.py
+    ASGI entry point serving the movie and actor read routes without
+    blocking a worker per request
+
+    uvicorn asgi:app --workers 2
+
+    GET /movies, /actors, /movies/<id> and /actors/<id> answer with the
+    same JSON as create_app() and accept the same arguments (after, limit,
+    fields, filters, include) and permissions. Writes, streaming, the
+    response cache and conditional requests stay with the WSGI app, so
+    route those to gunicorn 'app:create_app()'.
+
+    Statements go through the `databases` package (asyncpg/aiosqlite)
+    when it is installed, otherwise through a thread pool on the
+    synchronous engine. Token verification only leaves the event loop on
+    a token cache miss, to check the signature and to fetch unknown
+    signing keys.
+'''
+import asyncio
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+
+from flask import Flask, json
+from sqlalchemy import select
+from werkzeug.exceptions import BadRequest, HTTPException, MethodNotAllowed
+from werkzeug.exceptions import NotFound
+
+import auth
+from auth import AuthError, check_permissions, get_token_auth_header
+from app import get_page_args, get_fields, get_include, list_query
+from app import encode_cursor, get_ids, ids_query
+from models import setup_db, db, Movie, Actor, MovieActorAssociation
+from serializers import JSONEncoder
+
+try:
+    import databases
+except ImportError:
+    databases = None
+
+
+ASGI_DATABASE = os.environ.get(
+    'ASGI_DATABASE', 'executor' if databases is None else 'databases')
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 10))
+
+ERROR_MESSAGES = {
+    400: 'Bad request',
+    404: 'Resource was not found',
+    405: 'Method not found',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server error'
+}
+
+
+class ExecutorDatabase:
+    """Runs statements on the synchronous engine in a thread pool"""
+
+    def __init__(self, engine, executor):
+        self.engine = engine
+        self.executor = executor
+
+    async def connect(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+    async def fetch_all(self, statement):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self._fetch_all, statement)
+
+    def _fetch_all(self, statement):
+        with self.engine.connect() as connection:
+            return connection.execute(statement).fetchall()
+
+
+class AsyncDatabase:
+    """Runs statements on an async driver through the databases package"""
+
+    def __init__(self, url):
+        if databases is None:
+            raise RuntimeError('ASGI_DATABASE=databases needs the databases '
+                               'package')
+        self.database = databases.Database(
+            re.sub(r'^postgres://', 'postgresql://', url))
+
+    async def connect(self):
+        await self.database.connect()
+
+    async def disconnect(self):
+        await self.database.disconnect()
+
+    async def fetch_all(self, statement):
+        # attribute access like the engine's rows, for the format helpers
+        return [SimpleNamespace(**dict(record.items()))
+                for record in await self.database.fetch_all(statement)]
+
+
+def json_body(data):
+    # the separators and key order jsonify uses
+    return (json.dumps(data, cls=JSONEncoder, separators=(',', ':')) +
+            '\n').encode('utf-8')
+
+
+class CastingApp:
+    '''
+    the ASGI application; `flask_app` binds the models and supplies the
+    request parsing helpers of app.py through a short lived request
+    context that is never held across an await
+    '''
+
+    routes = [
+        (re.compile(r'^/movies/?$'), 'list_resources', Movie, 'movies'),
+        (re.compile(r'^/actors/?$'), 'list_resources', Actor, 'actors'),
+        (re.compile(r'^/movies/(\d+)$'), 'get_movie', Movie, 'movie'),
+        (re.compile(r'^/actors/(\d+)$'), 'get_actor', Actor, 'actor'),
+    ]
+
+    def __init__(self, database_path=None, backend=ASGI_DATABASE):
+        self.flask_app = Flask(__name__)
+        if database_path is None:
+            setup_db(self.flask_app)
+        else:
+            setup_db(self.flask_app, database_path)
+        self.executor = ThreadPoolExecutor(ASGI_THREADS)
+        if backend == 'databases':
+            self.database = AsyncDatabase(
+                self.flask_app.config['SQLALCHEMY_DATABASE_URI'])
+        elif backend == 'executor':
+            self.database = ExecutorDatabase(
+                db.get_engine(self.flask_app), self.executor)
+        else:
+            raise ValueError(f'unknown ASGI_DATABASE {backend!r}')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            status, body = await self.handle(scope)
+            await send({
+                'type': 'http.response.start',
+                'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode())]
+            })
+            await send({'type': 'http.response.body',
+                        'body': b'' if scope['method'] == 'HEAD' else body})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.database.connect()
+                auth.jwks_store.start_background_refresh()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                auth.jwks_store.stop_background_refresh()
+                await self.database.disconnect()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def handle(self, scope):
+        try:
+            for pattern, name, model, key in self.routes:
+                match = pattern.match(scope['path'])
+                if match is not None:
+                    break
+            else:
+                raise NotFound()
+            if scope['method'] not in ('GET', 'HEAD'):
+                raise MethodNotAllowed()
+            await self.authorize(scope, f'get:{model.__tablename__}s')
+            handler = getattr(self, name)
+            return 200, json_body(await handler(scope, model, key,
+                                                *match.groups()))
+        except AuthError as ex:
+            return ex.status_code, json_body(ex.error)
+        except HTTPException as ex:
+            return ex.code, json_body({
+                'success': False,
+                'error': ex.code,
+                'message': ERROR_MESSAGES.get(ex.code, ex.name)
+            })
+
+    def request_context(self, scope):
+        return self.flask_app.test_request_context(
+            scope['path'], query_string=scope['query_string'],
+            headers=[(name.decode('latin-1'), value.decode('latin-1'))
+                     for name, value in scope['headers']])
+
+    def query_args(self, scope):
+        return dict(parse_qsl(scope['query_string'].decode('latin-1')))
+
+    async def authorize(self, scope, permission):
+        with self.request_context(scope):
+            token = get_token_auth_header()
+        payload = auth.token_cache.get(token, auth.jwks_store)
+        if payload is None:
+            payload = await asyncio.get_event_loop().run_in_executor(
+                self.executor, auth.verify_decode_jwt, token)
+        check_permissions(permission, payload)
+        return payload
+
+    async def fetch_casts(self, movie_ids):
+        if not movie_ids:
+            return {}
+        return Movie.group_casts(await self.database.fetch_all(
+            Movie.cast_statement(movie_ids)))
+
+    async def format_movies(self, rows, fields=None):
+        if fields is not None and 'actors' not in fields:
+            return Movie.format_rows(rows, fields, {})
+        actor_ids = await self.fetch_casts([row.id for row in rows])
+        if fields is not None:
+            return Movie.format_rows(rows, fields, actor_ids)
+        return [Movie.format(row, actor_ids.get(row.id, []))
+                for row in rows]
+
+    async def format_resources(self, model, rows, fields):
+        if model is Movie:
+            return await self.format_movies(rows, fields)
+        if fields is None:
+            return [Actor.format(row) for row in rows]
+        return Actor.format_rows(rows, fields)
+
+    async def list_resources(self, scope, model, key):
+        if 'ids' in self.query_args(scope):
+            return await self.get_by_ids(scope, model, key)
+        if 'stream' in self.query_args(scope):
+            raise BadRequest()
+        with self.request_context(scope):
+            after, limit = get_page_args()
+            fields = get_fields(model)
+            statement = list_query(model, fields, after)
+            if limit is not None:
+                statement = statement.limit(limit + 1)
+        rows = await self.database.fetch_all(statement)
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].id)
+        if rows == [] and after is None:
+            raise NotFound()
+
+        response = {'success': True,
+                    key: await self.format_resources(model, rows, fields)}
+        args = self.query_args(scope)
+        if 'limit' in args or 'after' in args:
+            response['next_cursor'] = next_cursor
+        return response
+
+    async def get_by_ids(self, scope, model, key):
+        with self.request_context(scope):
+            ids = get_ids()
+            fields = get_fields(model)
+            statement = ids_query(model, fields, ids)
+        rows = {row.id: row for row in await self.database.fetch_all(
+            statement)}
+        found = [rows[resource_id] for resource_id in ids
+                 if resource_id in rows]
+        return {'success': True,
+                key: await self.format_resources(model, found, fields),
+                'missing': [resource_id for resource_id in ids
+                            if resource_id not in rows]}
+
+    async def fetch_one(self, model, resource_id):
+        table = model.__table__
+        rows = await self.database.fetch_all(
+            select([table]).where(table.c.id == int(resource_id)))
+        if not rows:
+            raise NotFound()
+        return rows[0]
+
+    async def get_movie(self, scope, model, key, movie_id):
+        with self.request_context(scope):
+            include = get_include('actors')
+        movie = await self.fetch_one(Movie, movie_id)
+        if not include:
+            formatted = (await self.format_movies([movie]))[0]
+        else:
+            actor, association = Actor.__table__, \
+                MovieActorAssociation.__table__
+            actors = await self.database.fetch_all(
+                select([actor]).select_from(actor.join(
+                    association, association.c.actor_id == actor.c.id)).where(
+                    association.c.movie_id == movie.id).order_by(
+                    association.c.id))
+            formatted = dict(Movie.format(movie, []),
+                             actors=[Actor.format(row) for row in actors])
+        return {'success': True, key: formatted}
+
+    async def get_actor(self, scope, model, key, actor_id):
+        with self.request_context(scope):
+            include = get_include('movies')
+        actor = await self.fetch_one(Actor, actor_id)
+        formatted = Actor.format(actor)
+        if include:
+            movie, association = Movie.__table__, \
+                MovieActorAssociation.__table__
+            movies = await self.database.fetch_all(
+                select([movie]).select_from(movie.join(
+                    association, association.c.movie_id == movie.c.id)).where(
+                    association.c.actor_id == actor.id).order_by(movie.c.id))
+            formatted['movies'] = await self.format_movies(movies)
+        return {'success': True, key: formatted}
+
+
+'''
+app
+    built on first access like app.app, so importing this module doesn't
+    need DATABASE_URL
+'''
+
+
+def __getattr__(name):
+    if name == 'app':
+        globals()['app'] = CastingApp()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
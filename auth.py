@@ -1,14 +1,29 @@
+import hashlib
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from flask import request
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
 
+from metrics import profiled
+
 
 AUTH0_DOMAIN = 'wcp.eu.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'casting'
 
+JWKS_URL = os.environ.get('JWKS_URL',
+                          f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_TTL = int(os.environ.get('JWKS_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = int(os.environ.get('JWKS_FETCH_TIMEOUT', 5))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+
 
 class AuthError(Exception):
     def __init__(self, error, status_code):
@@ -16,6 +31,217 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+def fetch_jwks(url=JWKS_URL):
+    '''
+    default JWKS fetcher, also accepts file:// urls for a local key set
+    '''
+    jsonurl = urlopen(url, timeout=JWKS_FETCH_TIMEOUT)
+    return json.loads(jsonurl.read())
+
+
+class JWKSKeyStore:
+    '''
+    in-process signing key store indexed by kid
+
+    Keys are kept for `ttl` seconds and refetched when they go stale or an
+    unknown kid shows up. Concurrent refetches collapse into a single fetch
+    and a failing fetch keeps serving the last known keys. After a failed
+    fetch no other fetch is tried for `min_refresh_interval` seconds, and
+    while the background refresh runs, stale keys are left to it instead
+    of being refetched by a request.
+    '''
+
+    def __init__(self, fetcher=fetch_jwks, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._attempts = 0
+        self._failing = False
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def get_key(self, kid):
+        if not self._keys or (self._is_stale() and
+                              not self._refreshing_in_background()):
+            self.refresh()
+        key = self._keys.get(kid)
+        if key is not None:
+            self.hits += 1
+            return key
+        self.misses += 1
+        if self._since_attempt() >= self.min_refresh_interval:
+            self.refresh()
+        return self._keys.get(kid)
+
+    def peek(self, kid):
+        '''
+        current key for kid without counting, refreshing or fetching
+        '''
+        return self._keys.get(kid)
+
+    def refresh(self):
+        attempts = self._attempts
+        with self._refresh_lock:
+            # another thread's fetch finished while we were waiting, or the
+            # last one failed too recently to try again
+            if self._attempts == attempts and not (
+                    self._failing and
+                    self._since_attempt() < self.min_refresh_interval):
+                self._fetch()
+            if not self._keys:
+                raise AuthError({
+                    'code': 'jwks_unavailable',
+                    'description': 'Unable to fetch signing keys.'
+                }, 503)
+
+    def _fetch(self):
+        try:
+            jwks = self.fetcher()
+        except Exception:
+            self.refresh_errors += 1
+            self._failing = True
+            return
+        finally:
+            self._attempted_at = time.monotonic()
+            self._attempts += 1
+        self._keys = {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            } for key in jwks['keys']
+        }
+        self._fetched_at = self._attempted_at
+        self._failing = False
+        self.refreshes += 1
+
+    def start_background_refresh(self, interval=None):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        interval = interval or self.ttl / 2
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop,
+                                        args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'keys': len(self._keys)
+        }
+
+    def _refresh_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except AuthError:
+                pass
+
+    def _refreshing_in_background(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _since_attempt(self):
+        if self._attempted_at is None:
+            return float('inf')
+        return time.monotonic() - self._attempted_at
+
+    def _is_stale(self):
+        if self._fetched_at is None:
+            return True
+        return time.monotonic() - self._fetched_at >= self.ttl
+
+
+class TokenCache:
+    '''
+    bounded LRU cache of verified token payloads keyed by a token hash
+
+    An entry lives until the token's exp claim and is dropped as soon as the
+    key that signed it is no longer served by the key store.
+    '''
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token, key_store):
+        digest = self._digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, rsa_key, expires_at = entry
+            if expires_at <= time.time() or \
+                    key_store.peek(rsa_key['kid']) != rsa_key:
+                del self._entries[digest]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return payload
+
+    def set(self, token, payload, rsa_key):
+        if 'exp' not in payload or self.maxsize <= 0:
+            return
+        digest = self._digest(token)
+        with self._lock:
+            self._entries[digest] = (payload, rsa_key, payload['exp'])
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self._entries)
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+jwks_store = JWKSKeyStore()
+token_cache = TokenCache()
+
+
 def get_token_auth_header():
     auth = request.headers.get('Authorization', None)
     if not auth:
@@ -62,26 +288,21 @@ def check_permissions(permission, payload):
     return True
 
 
-def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+def verify_decode_jwt(token, key_store=None, cache=None):
+    key_store = key_store or jwks_store
+    cache = token_cache if cache is None else cache
+    payload = cache.get(token, key_store)
+    if payload is not None:
+        return payload
+
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if 'kid' not in unverified_header:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    rsa_key = key_store.get_key(unverified_header['kid'])
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -91,7 +312,7 @@ def verify_decode_jwt(token):
                 audience=API_AUDIENCE,
                 issuer='https://' + AUTH0_DOMAIN + '/'
             )
-
+            cache.set(token, payload, rsa_key)
             return payload
 
         except jwt.ExpiredSignatureError:
@@ -121,9 +342,10 @@ def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            with profiled('auth'):
+                token = get_token_auth_header()
+                payload = verify_decode_jwt(token)
+                check_permissions(permission, payload)
             return f(payload, *args, **kwargs)
 
         return wrapper
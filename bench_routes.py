@@ -0,0 +1,174 @@
+'''
+bench_routes.py
+    pytest-benchmark suite timing every route of create_app() at growing
+    table sizes, with results kept between runs to catch regressions
+
+    pytest bench_routes.py --benchmark-autosave
+    pytest bench_routes.py --benchmark-compare \
+        --benchmark-compare-fail=median:10%
+    BENCH_SIZES=1000,100000 pytest bench_routes.py -k movies
+
+    Requests go through the test client with tokens from testing.LocalIssuer,
+    so token verification is part of what is measured (after the first
+    request of a token it is a token cache hit). The tables are seeded by
+    benchmark.reset_tables; each benchmark runs in a transaction that is
+    rolled back, so writes don't leak into the next one. The response cache
+    is off, set BENCH_CACHE=1 to measure with it.
+'''
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from benchmark import reset_tables  # noqa: E402
+from cache import response_cache  # noqa: E402
+from metrics import METRICS_ENABLED  # noqa: E402
+from testing import LocalIssuer, TestDatabase  # noqa: E402
+
+
+SIZES = [int(size) for size in
+         os.environ.get('BENCH_SIZES', '100,1000,10000').split(',')]
+BENCH_CACHE = os.environ.get('BENCH_CACHE', '') in ('1', 'true')
+
+ACTOR = {'name': 'Benchmark Actor', 'gender': 'male', 'age': 42}
+MOVIE = {'title': 'Benchmark Movie', 'release_date': '2002-12-04',
+         'actors': [1, 2, 3]}
+
+
+@pytest.fixture(scope='session')
+def issuer():
+    issuer = LocalIssuer()
+    issuer.install()
+    yield issuer
+    issuer.uninstall()
+
+
+@pytest.fixture(scope='session')
+def database(issuer):
+    backend = response_cache.backend
+    if not BENCH_CACHE:
+        response_cache.backend = None
+    database = TestDatabase()
+    yield database
+    database.close()
+    response_cache.backend = backend
+
+
+@pytest.fixture(scope='module', params=SIZES, ids='size={}'.format)
+def size(request, database):
+    with database.app.app_context():
+        reset_tables(request.param, movies=request.param)
+    return request.param
+
+
+@pytest.fixture
+def client(database, size, benchmark):
+    benchmark.extra_info['size'] = size
+    database.begin()
+    yield database.app.test_client()
+    database.rollback()
+
+
+@pytest.fixture
+def headers(issuer):
+    return issuer.headers('executive')
+
+
+def read(response):
+    # streamed bodies are only produced when they are read
+    response.get_data()
+    return response
+
+
+def run(benchmark, request, status=200):
+    response = benchmark(lambda: read(request()))
+    assert response.status_code == status, response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('url', ['/movies', '/movies?limit=50',
+                                 '/movies?fields=id,title',
+                                 '/movies?stream=json'])
+def test_get_movies(benchmark, client, headers, url):
+    run(benchmark, lambda: client.get(url, headers=headers))
+
+
+@pytest.mark.parametrize('url', ['/actors', '/actors?limit=50',
+                                 '/actors?gender=female',
+                                 '/actors?stream=ndjson'])
+def test_get_actors(benchmark, client, headers, url):
+    run(benchmark, lambda: client.get(url, headers=headers))
+
+
+@pytest.mark.parametrize('url', ['/movies/1', '/movies/1?include=actors'])
+def test_get_movie(benchmark, client, headers, url):
+    run(benchmark, lambda: client.get(url, headers=headers))
+
+
+@pytest.mark.parametrize('url', ['/actors/1', '/actors/1?include=movies'])
+def test_get_actor(benchmark, client, headers, url):
+    run(benchmark, lambda: client.get(url, headers=headers))
+
+
+def test_post_movie(benchmark, client, headers):
+    run(benchmark, lambda: client.post('/movies', json=MOVIE,
+                                       headers=headers))
+
+
+def test_post_actor(benchmark, client, headers):
+    run(benchmark, lambda: client.post('/actors', json=ACTOR,
+                                       headers=headers))
+
+
+def test_bulk_movies(benchmark, client, headers):
+    run(benchmark, lambda: client.post('/movies/bulk', json=[MOVIE] * 100,
+                                       headers=headers))
+
+
+def test_bulk_actors(benchmark, client, headers):
+    run(benchmark, lambda: client.post('/actors/bulk', json=[ACTOR] * 100,
+                                       headers=headers))
+
+
+def test_patch_movie(benchmark, client, headers):
+    run(benchmark, lambda: client.patch('/movies/1', json=MOVIE,
+                                        headers=headers))
+
+
+def test_patch_movie_actors(benchmark, client, headers):
+    run(benchmark, lambda: client.patch(
+        '/movies/1/actors', json={'add': [4], 'remove': []},
+        headers=headers))
+
+
+def test_patch_actor(benchmark, client, headers):
+    run(benchmark, lambda: client.patch('/actors/1', json=ACTOR,
+                                        headers=headers))
+
+
+def created(client, headers, url, body):
+    # a fresh resource for every round of the delete benchmarks
+    resource_id = client.post(url, json=body, headers=dict(
+        headers, Prefer='return=minimal')).get_json()['id']
+    return (f'{url}/{resource_id}',), {}
+
+
+def test_delete_movie(benchmark, client, headers):
+    response = benchmark.pedantic(
+        lambda url: read(client.delete(url, headers=headers)),
+        setup=lambda: created(client, headers, '/movies', MOVIE),
+        rounds=50)
+    assert response.status_code == 200
+
+
+def test_delete_actor(benchmark, client, headers):
+    response = benchmark.pedantic(
+        lambda url: read(client.delete(url, headers=headers)),
+        setup=lambda: created(client, headers, '/actors', ACTOR),
+        rounds=50)
+    assert response.status_code == 200
+
+
+@pytest.mark.skipif(not METRICS_ENABLED, reason='needs METRICS_ENABLED=1')
+def test_get_metrics(benchmark, client):
+    run(benchmark, lambda: client.get('/metrics'))
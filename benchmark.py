@@ -0,0 +1,345 @@
+'''
+benchmark.py
+    micro benchmarks for the API endpoints at growing table sizes
+
+    python benchmark.py writes --sizes 100 1000 10000
+    python benchmark.py filters --sizes 1000000 --database postgresql://...
+    python benchmark.py startup --repeat 10
+    python benchmark.py read_path --sizes 10000 100000 1000000 --repeat 3
+    python benchmark.py unit_of_work --sizes 10 100 --database sqlite:///b.db
+
+    The benchmarks run against --database (an in-memory sqlite database by
+    default). The tables of that database are dropped and recreated for
+    every size, so never point it at a database holding real data.
+'''
+import argparse
+import datetime
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+
+PERMISSIONS = ['get:movies', 'post:movies', 'patch:movies', 'delete:movies',
+               'get:actors', 'post:actors', 'patch:actors', 'delete:actors']
+HEADERS = {'Authorization': 'Bearer benchmark'}
+TITLE_WORDS = ['Terminator', 'Heat', 'Alien', 'Casablanca', 'Vertigo',
+               'Jaws', 'Rocky', 'Psycho', 'Fargo', 'Amelie']
+
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def insert_chunked(table, rows, size=10000):
+    from models import db
+
+    for start in range(0, len(rows), size):
+        db.session.execute(table.insert(), rows[start:start + size])
+
+
+def reset_tables(size, movies=0, cast=3):
+    '''
+    recreates the tables with `size` actors and `movies` movies of `cast`
+    random actors each, deterministic across runs
+    '''
+    from cache import response_cache
+    from models import db, Actor, Movie, MovieActorAssociation
+
+    db.drop_all()
+    db.create_all()
+    now = datetime.datetime.utcnow()
+    rng = random.Random(42)
+    insert_chunked(Actor.__table__, [
+        {'name': f'Actor {i}', 'gender': ('female', 'male')[i % 2],
+         'age': 20 + i % 60, 'updated_at': now}
+        for i in range(size)
+    ])
+    insert_chunked(Movie.__table__, [
+        {'title': f'Movie {i} {rng.choice(TITLE_WORDS)}',
+         'release_date': datetime.date(1950, 1, 1) +
+         datetime.timedelta(days=rng.randrange(365 * 70)),
+         'updated_at': now}
+        for i in range(movies)
+    ])
+    if size:
+        insert_chunked(MovieActorAssociation.__table__, [
+            {'movie_id': movie_id, 'actor_id': actor_id}
+            for movie_id in range(1, movies + 1)
+            for actor_id in set(rng.randrange(1, size + 1)
+                                for _ in range(cast))
+        ])
+    db.session.commit()
+    response_cache.invalidate('movies', 'actors')
+
+
+def report(name, size, results):
+    line = ', '.join(f'{label} {seconds * 1000:8.2f} ms'
+                     for label, seconds in results)
+    print(f'{name:<24} {size:>9} rows: {line}')
+
+
+def bench_writes(client, sizes, repeat):
+    '''
+    single-row writes answered with the full listing versus only the
+    affected resource (Prefer: return=minimal)
+    '''
+    minimal = dict(HEADERS, Prefer='return=minimal')
+    body = {'name': 'Benchmark Actor', 'gender': 'male', 'age': 42}
+
+    for size in sizes:
+        reset_tables(size)
+        for label, headers in (('legacy', HEADERS), ('minimal', minimal)):
+            create = timed(lambda: client.post(
+                '/actors', json=body, headers=headers), repeat)
+            edit = timed(lambda: client.patch(
+                '/actors/1', json=body, headers=headers), repeat)
+            report(f'POST/PATCH actor {label}', size,
+                   [('create', create), ('edit', edit)])
+
+
+def first_byte_and_peak(client, url, headers):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chunks = iter(client.get(url, headers=headers).response)
+    next(chunks)
+    first_byte = time.perf_counter() - start
+    for _ in chunks:
+        pass
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return first_byte, total, peak
+
+
+def bench_listing(client, sizes, repeat):
+    '''
+    GET /actors built in memory versus streamed as a JSON array
+    and as NDJSON: time to first byte, total time and peak Python memory
+    '''
+    for size in sizes:
+        reset_tables(size)
+        for label, url in (('buffered', '/actors'),
+                           ('stream json', '/actors?stream=json'),
+                           ('stream ndjson', '/actors?stream=ndjson')):
+            first_byte, total, peak = first_byte_and_peak(
+                client, url, HEADERS)
+            report(f'GET actors {label}', size,
+                   [('first byte', first_byte), ('total', total)])
+            print(f'{"":<24} {"":>9}       peak memory {peak / 2**20:.1f} MiB')
+
+
+def bench_bulk(client, sizes, repeat):
+    '''
+    loading actors one POST /actors at a time versus one POST /actors/bulk
+    '''
+    minimal = dict(HEADERS, Prefer='return=minimal')
+    for size in sizes:
+        records = [{'name': f'Actor {i}', 'gender': 'male', 'age': 30}
+                   for i in range(size)]
+
+        reset_tables(0)
+        start = time.perf_counter()
+        for record in records:
+            client.post('/actors', json=record, headers=minimal)
+        single = time.perf_counter() - start
+
+        reset_tables(0)
+        start = time.perf_counter()
+        client.post('/actors/bulk', json=records, headers=HEADERS)
+        bulk = time.perf_counter() - start
+
+        report('load actors', size, [('single', single), ('bulk', bulk)])
+
+
+def bench_unit_of_work(client, sizes, repeat):
+    '''
+    a request creating `size` actors through Actor.insert(): committed
+    per call, as outside a request, versus flushed per call and committed
+    once by the request's unit of work versus added and flushed together;
+    commits only cost an fsync on a file or server --database
+    '''
+    from models import db, unit_of_work, Actor
+
+    app = client.application
+
+    def actors(size):
+        return [Actor(name=f'Actor {i}', gender='male', age=30)
+                for i in range(size)]
+
+    def per_call(size):
+        for actor in actors(size):
+            actor.insert()
+        db.session.remove()
+
+    def per_request(size, batched):
+        with app.test_request_context(method='POST'):
+            unit_of_work.begin()
+            if batched:
+                db.session.add_all(actors(size))
+                unit_of_work.commit('actors')
+            else:
+                for actor in actors(size):
+                    actor.insert()
+            unit_of_work.end(app.response_class())
+        db.session.remove()
+
+    for size in sizes:
+        reset_tables(0)
+        report('create actors', size, [
+            ('commit per call', timed(lambda: per_call(size), repeat)),
+            ('per request', timed(lambda: per_request(size, False), repeat)),
+            ('batched', timed(lambda: per_request(size, True), repeat))])
+
+
+def bench_filters(client, sizes, repeat):
+    '''
+    first page of the filtered listings over `size` movies and actors
+    '''
+    queries = [
+        ('title', '/movies?title=casa&limit=100'),
+        ('title prefix', '/movies?title_prefix=movie%2012&limit=100'),
+        ('release range',
+         '/movies?released_from=1990-01-01&released_to=1990-12-31&limit=100'),
+        ('featuring actor', '/movies?actor=7&limit=100'),
+        ('age and gender',
+         '/actors?gender=male&min_age=30&max_age=35&limit=100'),
+        ('name', '/actors?name=or%2099&limit=100'),
+        ('appeared from', '/actors?appeared_from=2019-06-01&limit=100'),
+    ]
+    for size in sizes:
+        reset_tables(size, movies=size)
+        for label, url in queries:
+            report(f'filter {label}', size, [('first page', timed(
+                lambda: client.get(url, headers=HEADERS), repeat))])
+
+
+# run in a fresh interpreter, prints the import, create_app and first
+# request times; the tables are created untimed before the first request
+STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+import auth
+import app
+imported = time.perf_counter()
+application = app.create_app()
+created = time.perf_counter()
+from models import db
+with application.app_context():
+    db.create_all()
+auth.verify_decode_jwt = lambda token: {'permissions': ['get:actors']}
+before_request = time.perf_counter()
+application.test_client().get('/actors', headers=%r)
+print(imported - start, created - imported,
+      time.perf_counter() - before_request)
+'''
+
+
+def bench_startup(client, sizes, repeat):
+    '''
+    worker cold start in a new interpreter: importing the app module,
+    create_app() and the first request, which opens the first connection
+    '''
+    timings = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT % HEADERS],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        timings.append([float(value) for value in output.split()])
+    medians = [statistics.median(column) for column in zip(*timings)]
+    report('worker cold start', 0,
+           list(zip(('import', 'create_app', 'first request'), medians)))
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def bench_read_path(client, sizes, repeat):
+    '''
+    the whole GET /movies listing built from ORM instances (query.all()
+    and format_all) versus the Core select and compiled serializers
+    '''
+    from flask import jsonify
+    import app as api
+    from models import db, Movie
+
+    def orm():
+        movies = Movie.query.order_by(Movie.id).all()
+        jsonify({'success': True, 'movies': Movie.format_all(movies)})
+        db.session.remove()
+
+    def core():
+        api.list_response(Movie, 'movies')
+        db.session.remove()
+
+    for size in sizes:
+        reset_tables(size, movies=size)
+        with client.application.test_request_context('/movies'):
+            for label, fn in (('orm', orm), ('core', core)):
+                report(f'list movies {label}', size,
+                       [('total', timed(fn, repeat))])
+                print(f'{"":<24} {"":>9}       '
+                      f'peak memory {peak_memory(fn) / 2**20:.1f} MiB')
+
+
+BENCHMARKS = {
+    'writes': bench_writes,
+    'listing': bench_listing,
+    'bulk': bench_bulk,
+    'unit_of_work': bench_unit_of_work,
+    'filters': bench_filters,
+    'startup': bench_startup,
+    'read_path': bench_read_path,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='micro benchmarks for the API endpoints')
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS),
+                        help='one or more of: ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[100, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', default='sqlite://')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the response cache enabled')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r}')
+
+    # models reads DATABASE_URL at import time
+    os.environ['DATABASE_URL'] = args.database
+    import auth
+    from app import app
+    from cache import response_cache
+
+    if not args.cache:
+        response_cache.backend = None
+
+    # token verification is not what is measured here
+    auth.verify_decode_jwt = lambda token: {'permissions': PERMISSIONS}
+
+    with app.app_context():
+        client = app.test_client()
+        for name in args.benchmarks:
+            BENCHMARKS[name](client, args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
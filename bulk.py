@@ -0,0 +1,189 @@
+import datetime
+import os
+
+from sqlalchemy import bindparam
+
+from models import db, unit_of_work, Movie, Actor, MovieActorAssociation
+from models import RETURNING_DIALECTS
+
+
+MAX_BULK_SIZE = int(os.environ.get('MAX_BULK_SIZE', 10000))
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 1000))
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_id(record):
+    if 'id' not in record:
+        return None
+    if not is_int(record['id']):
+        raise InvalidRecord('id must be an integer')
+    return record['id']
+
+
+def validate_actor(record):
+    if not isinstance(record, dict):
+        raise InvalidRecord('record must be an object')
+    if not isinstance(record.get('name'), str) or not record['name']:
+        raise InvalidRecord('name must be a non-empty string')
+    if not isinstance(record.get('gender'), str):
+        raise InvalidRecord('gender must be a string')
+    if not is_int(record.get('age')):
+        raise InvalidRecord('age must be an integer')
+    return validate_id(record), {
+        'name': record['name'],
+        'gender': record['gender'],
+        'age': record['age']
+    }
+
+
+def validate_movie(record):
+    if not isinstance(record, dict):
+        raise InvalidRecord('record must be an object')
+    if not isinstance(record.get('title'), str) or not record['title']:
+        raise InvalidRecord('title must be a non-empty string')
+    try:
+        release_date = datetime.datetime.strptime(
+            record.get('release_date'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise InvalidRecord('release_date must be a YYYY-MM-DD date')
+    actors = record.get('actors', [])
+    if not isinstance(actors, list) or not all(map(is_int, actors)):
+        raise InvalidRecord('actors must be a list of actor ids')
+    return validate_id(record), {
+        'title': record['title'],
+        'release_date': release_date
+    }
+
+
+def chunks(rows, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+'''
+insert_rows(table, rows)
+    inserts rows inside the current transaction and returns their ids, one
+    multi-row INSERT ... RETURNING per chunk where the database supports it
+'''
+
+
+def insert_rows(table, rows):
+    if db.engine.dialect.name in RETURNING_DIALECTS:
+        ids = []
+        for chunk in chunks(rows):
+            result = db.session.execute(
+                table.insert().values(chunk).returning(table.c.id))
+            ids.extend(row[0] for row in result)
+        return ids
+    return [db.session.execute(table.insert(), row).inserted_primary_key[0]
+            for row in rows]
+
+
+def update_rows(table, ids, rows):
+    if not rows:
+        return
+    statement = table.update().where(table.c.id == bindparam('_id')).values(
+        {column: bindparam(column) for column in rows[0]})
+    for chunk in chunks([dict(row, _id=row_id)
+                         for row_id, row in zip(ids, rows)]):
+        db.session.execute(statement, chunk)
+
+
+def existing_ids(model, ids):
+    found = set()
+    for chunk in chunks(ids):
+        found.update(row.id for row in db.session.query(model.id).filter(
+            model.id.in_(chunk)))
+    return found
+
+
+'''
+bulk_write(model, records, validate, check=None)
+    validates every record (check may reject a valid record with an error
+    message), then creates (no id) or updates (with id) the rest in the
+    current transaction; returns a status per record and the (id, record)
+    pairs that were created and updated
+'''
+
+
+def bulk_write(model, records, validate, check=None):
+    results = [{'index': index} for index in range(len(records))]
+    valid = []
+    for index, record in enumerate(records):
+        try:
+            record_id, values = validate(record)
+        except InvalidRecord as error:
+            results[index].update(status='invalid', error=str(error))
+            continue
+        valid.append((index, record_id, values))
+
+    found = existing_ids(model, [record_id for _, record_id, _ in valid
+                                 if record_id is not None])
+    creates, updates = [], []
+    for index, record_id, values in valid:
+        error = check(records[index]) if check is not None else None
+        if error is not None:
+            results[index].update(status='invalid', error=error)
+        elif record_id is None:
+            creates.append((index, values))
+        elif record_id not in found:
+            results[index].update(status='not_found', id=record_id)
+        else:
+            updates.append((index, record_id, values))
+
+    table = model.__table__
+    created_ids = insert_rows(table, [values for _, values in creates])
+    update_rows(table, [record_id for _, record_id, _ in updates],
+                [values for _, _, values in updates])
+
+    created = []
+    for (index, _), record_id in zip(creates, created_ids):
+        results[index].update(status='created', id=record_id)
+        created.append((record_id, records[index]))
+    updated = []
+    for index, record_id, _ in updates:
+        results[index].update(status='updated', id=record_id)
+        updated.append((record_id, records[index]))
+    return results, created, updated
+
+
+def bulk_write_actors(records):
+    results, _, _ = bulk_write(Actor, records, validate_actor)
+    unit_of_work.commit('actors')
+    return results
+
+
+def bulk_write_movies(records):
+    referenced = {actor_id for record in records if isinstance(record, dict)
+                  and isinstance(record.get('actors'), list)
+                  for actor_id in record['actors'] if is_int(actor_id)}
+    known = existing_ids(Actor, list(referenced))
+
+    def check_actors(record):
+        unknown = sorted(set(record.get('actors', [])) - known)
+        if unknown:
+            return f'unknown actor ids {unknown}'
+
+    results, created, updated = bulk_write(Movie, records, validate_movie,
+                                           check_actors)
+
+    # an update without actors keeps the cast it has; the updated movies
+    # already got their new version from update_rows
+    Movie.sync_casts({movie_id: record['actors']
+                      for movie_id, record in updated if 'actors' in record},
+                     touch=False)
+    pairs = [{'movie_id': movie_id, 'actor_id': actor_id}
+             for movie_id, record in created
+             for actor_id in dict.fromkeys(record.get('actors', []))]
+    association = MovieActorAssociation.__table__
+    for chunk in chunks(pairs):
+        db.session.execute(association.insert(), chunk)
+    unit_of_work.commit('movies')
+    return results
@@ -0,0 +1,250 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+
+from flask import Response, current_app, make_response, request
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/0')
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 512))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 60))
+
+
+class MemoryBackend:
+    '''
+    per-process LRU with a TTL; versions are per process as well, so with
+    several workers a write only invalidates the worker that handled it and
+    the other workers catch up after at most `ttl` seconds
+    '''
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def version(self, namespace):
+        return self._versions.get(namespace, 0)
+
+    def bump(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+
+class RedisBackend:
+    '''
+    shared cache in a Redis compatible server, entries expire after `ttl`
+    seconds and versions are shared by all workers
+    '''
+
+    def __init__(self, url=CACHE_URL, ttl=CACHE_TTL):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis needs the redis package')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        etag, body, mimetype = self.client.hmget(
+            key, 'etag', 'body', 'mimetype')
+        if body is None:
+            return None
+        return etag.decode('ascii'), body, mimetype.decode('ascii')
+
+    def set(self, key, value):
+        etag, body, mimetype = value
+        pipeline = self.client.pipeline()
+        pipeline.hset(key, mapping={
+            'etag': etag, 'body': body, 'mimetype': mimetype})
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def version(self, namespace):
+        return int(self.client.get(f'version:{namespace}') or 0)
+
+    def bump(self, namespace):
+        self.client.incr(f'version:{namespace}')
+
+
+class ResponseCache:
+    '''
+    read-through cache for GET responses, keyed by path, query arguments
+    and the version counter of the namespace the response depends on
+
+    Writes call invalidate(namespace), which bumps the version so every
+    cached response of that namespace stops matching. A `version` callable
+    passed to cached() is added to the key next to the counter, e.g. a
+    validator read from the database that all workers agree on. The
+    namespace may be a callable as well, for per-resource entries.
+    '''
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def invalidate(self, *namespaces):
+        if self.backend is None:
+            return
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+
+    def key(self, namespace, version=None):
+        if callable(namespace):
+            namespace = namespace()
+        args = urlencode(sorted(request.args.items(multi=True)))
+        counter = self.backend.version(namespace)
+        if version is not None:
+            counter = f'{counter}.{version()}'
+        return f'response:{namespace}:{counter}:{request.path}?{args}'
+
+    def cached(self, namespace, bypass=None, version=None):
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.backend is None or (bypass is not None and bypass()):
+                    return f(*args, **kwargs)
+
+                key = self.key(namespace, version)
+                compression = current_app.extensions.get('compression')
+                encoding = None if compression is None else \
+                    compression.accepted()
+                if encoding is not None:
+                    entry = self.backend.get(f'{key}:{encoding}')
+                    if entry is not None:
+                        self.hits += 1
+                        return self.respond(*entry, encoding=encoding)
+
+                entry = self.backend.get(key)
+                if entry is not None:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    response = f(*args, **kwargs)
+                    if not isinstance(response, Response) or \
+                            response.status_code != 200 or \
+                            response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    entry = (etag_for(body), body, response.mimetype)
+                    self.backend.set(key, entry)
+
+                etag, body, mimetype = entry
+                if encoding is None or \
+                        request.if_none_match.contains_weak(etag) or \
+                        compression.negotiate(mimetype, len(body)) is None:
+                    return self.respond(*entry)
+                # the compressed body is kept next to the plain one and
+                # invalidated with it, later hits send it as it is
+                entry = (etag, compression.compress(body, encoding), mimetype)
+                self.backend.set(f'{key}:{encoding}', entry)
+                return self.respond(*entry, encoding=encoding)
+
+            return wrapper
+        return cached_decorator
+
+    def respond(self, etag, body, mimetype, encoding=None):
+        if request.if_none_match.contains_weak(etag):
+            self.not_modified += 1
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype=mimetype)
+        response.set_etag(etag)
+        if encoding is not None and response.status_code == 200:
+            current_app.extensions['compression'].encoded(response, encoding)
+        return response
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+def etag_for(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+'''
+conditional(validator, bypass=None)
+    answers If-None-Match / If-Modified-Since before the view runs;
+    validator returns the weak etag (and optionally the last modification
+    time) of what the view would return
+'''
+
+
+def conditional(validator, bypass=None):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if bypass is not None and bypass():
+                return f(*args, **kwargs)
+
+            etag, last_modified = validator()
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = last_modified is not None and \
+                    request.if_modified_since is not None and \
+                    last_modified.replace(microsecond=0) <= \
+                    request.if_modified_since.replace(tzinfo=None)
+
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            return response
+
+        return wrapper
+    return conditional_decorator
+
+
+def make_backend(name=CACHE_BACKEND):
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'redis':
+        return RedisBackend()
+    if name == 'none':
+        return None
+    raise ValueError(f'unknown CACHE_BACKEND {name!r}')
+
+
+response_cache = ResponseCache(make_backend())
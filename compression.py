@@ -0,0 +1,186 @@
+'''
+compression.py
+    negotiated Content-Encoding of the JSON responses
+
+    The encodings are tried in COMPRESS_ENCODINGS order among those the
+    client accepts with the highest q-value: br needs the brotli package,
+    zstd the zstandard package, gzip is always there. Buffered bodies
+    under COMPRESS_MIN_SIZE bytes are sent as they are. Streamed listings
+    are compressed chunk by chunk and flushed after every batch, so a
+    client reads each batch as soon as it was encoded.
+
+    The response cache looks the extension up in app.extensions and keeps
+    the compressed bodies next to the plain ones, so a cache hit is sent
+    without compressing it again.
+'''
+import os
+import zlib
+
+from flask import request
+
+from metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESS_ENCODINGS = os.environ.get('COMPRESS_ENCODINGS', 'br,zstd,gzip')
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+COMPRESS_ZSTD_LEVEL = int(os.environ.get('COMPRESS_ZSTD_LEVEL', 3))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson',
+                          'text/plain', 'text/html')
+
+compressed_responses = registry.counter(
+    'http_compressed_responses_total', 'Responses sent compressed',
+    labels=('encoding',))
+
+
+class GzipEncoder:
+    def __init__(self):
+        # wbits 31 writes the gzip header, with a zero mtime
+        self._compressor = zlib.compressobj(
+            COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(
+            level=COMPRESS_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+ENCODERS = {'gzip': GzipEncoder}
+if brotli is not None:
+    ENCODERS['br'] = BrotliEncoder
+if zstandard is not None:
+    ENCODERS['zstd'] = ZstdEncoder
+
+
+class Compression:
+    '''
+    after_request compression of the responses; encodings whose package
+    isn't installed are left out
+    '''
+
+    def __init__(self, encodings=COMPRESS_ENCODINGS,
+                 min_size=COMPRESS_MIN_SIZE):
+        self.encodings = [encoding.strip() for encoding in
+                          encodings.split(',')
+                          if encoding.strip() in ENCODERS]
+        self.min_size = min_size
+
+    def init_app(self, app):
+        app.extensions['compression'] = self
+        app.after_request(self.after_request)
+
+    def accepted(self):
+        '''
+        the preferred encoding the request accepts, None for none of them
+        '''
+        return request.accept_encodings.best_match(self.encodings)
+
+    def negotiate(self, mimetype, size=None):
+        '''
+        the encoding of a body of the given mimetype and size (None for a
+        stream), or None to send it as it is
+        '''
+        if mimetype not in COMPRESSIBLE_MIMETYPES:
+            return None
+        if size is not None and size < self.min_size:
+            return None
+        return self.accepted()
+
+    def compress(self, body, encoding):
+        encoder = ENCODERS[encoding]()
+        return encoder.compress(body) + encoder.finish()
+
+    def stream(self, chunks, encoding, charset):
+        encoder = ENCODERS[encoding]()
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode(charset)
+            data = encoder.compress(chunk) + encoder.flush()
+            if data:
+                yield data
+        yield encoder.finish()
+
+    def encoded(self, response, encoding):
+        '''
+        marks a response whose body is encoded: the strong etag of the
+        plain body becomes weak, as the bytes sent differ from it
+        '''
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        compressed_responses.inc(encoding=encoding)
+        return response
+
+    def after_request(self, response):
+        if response.mimetype in COMPRESSIBLE_MIMETYPES:
+            response.vary.add('Accept-Encoding')
+        if response.direct_passthrough or \
+                'Content-Encoding' in response.headers or \
+                response.status_code < 200 or \
+                response.status_code in (204, 304):
+            return response
+
+        if response.is_streamed:
+            encoding = self.negotiate(response.mimetype)
+            if encoding is None:
+                return response
+            response.response = self.stream(
+                response.response, encoding, response.charset)
+            response.headers.pop('Content-Length', None)
+            return self.encoded(response, encoding)
+
+        body = response.get_data()
+        encoding = self.negotiate(response.mimetype, len(body))
+        if encoding is None:
+            return response
+        response.set_data(self.compress(body, encoding))
+        return self.encoded(response, encoding)
+
+
+compression = Compression()
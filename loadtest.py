@@ -0,0 +1,124 @@
+'''
+loadtest.py
+    many concurrent clients against a running server, to compare the WSGI
+    app (gunicorn 'app:create_app()') with the ASGI entry point
+    (uvicorn asgi:app)
+
+    gunicorn 'app:create_app()' --workers 4 --bind 127.0.0.1:8000
+    uvicorn asgi:app --workers 4 --port 8001
+    python loadtest.py http://127.0.0.1:8000/movies?limit=50 \
+        http://127.0.0.1:8001/movies?limit=50 --clients 10 100 500
+
+    Every client keeps one HTTP/1.1 connection open and sends requests back
+    to back for --duration seconds. The token comes from --token or the
+    TOKEN environment variable.
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed by the server')
+    version, status = status_line.split()[:2]
+    keep_alive = version == b'HTTP/1.1'
+    length = None
+    chunked = False
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name = name.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'transfer-encoding' and 'chunked' in value.lower():
+            chunked = True
+        elif name == 'connection':
+            keep_alive = value.strip().lower() == 'keep-alive'
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length is not None:
+        await reader.readexactly(length)
+    return int(status), keep_alive
+
+
+async def client(url, token, deadline, latencies, errors):
+    parts = urlsplit(url)
+    path = parts.path + ('?' + parts.query if parts.query else '')
+    request = (f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'
+               f'Authorization: Bearer {token}\r\n\r\n').encode('latin-1')
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(
+                    parts.hostname, parts.port or 80)
+            start = time.perf_counter()
+            writer.write(request)
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+            if not keep_alive:
+                writer.close()
+                writer = None
+        except (OSError, ValueError, asyncio.IncompleteReadError) as error:
+            errors.append(type(error).__name__)
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run(url, token, clients, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(url, token, deadline, latencies, errors)
+                           for _ in range(clients)))
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(url, clients, duration, latencies, errors):
+    latencies.sort()
+    line = f'{url:<40} {clients:>5} clients: {len(latencies) / duration:8.1f}'
+    if latencies:
+        line += ' req/s, ' + ', '.join(
+            f'{label} {seconds * 1000:8.2f} ms' for label, seconds in (
+                ('p50', statistics.median(latencies)),
+                ('p95', percentile(latencies, 0.95)),
+                ('p99', percentile(latencies, 0.99))))
+    print(line + f', {len(errors)} errors')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='concurrent GET load against running servers')
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--clients', nargs='+', type=int,
+                        default=[10, 100, 500])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--token', default=os.environ.get('TOKEN', ''))
+    args = parser.parse_args()
+
+    for clients in args.clients:
+        for url in args.urls:
+            latencies, errors = asyncio.run(
+                run(url, args.token, clients, args.duration))
+            report(url, clients, args.duration, latencies, errors)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '') in ('1', 'true')
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.5))
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self._values.items()):
+            yield self.name, format_labels(self.labels, key), value
+
+
+class Gauge:
+    '''
+    a value read from `function` whenever the metrics are rendered
+    '''
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self):
+        yield self.name, '', self.function()
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + '_bucket', format_labels(
+                    self.labels, key, [('le', format_value(bound))]), \
+                    cumulative
+            yield self.name + '_sum', format_labels(self.labels, key), total
+            yield self.name + '_count', format_labels(self.labels, key), \
+                cumulative
+
+
+class Registry:
+    '''
+    collects metrics and renders them in the Prometheus text format
+    '''
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, function):
+        return self.register(Gauge(name, documentation, function))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+request_seconds = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request',
+    labels=('endpoint', 'method'))
+request_queries = registry.histogram(
+    'http_request_queries', 'Statements sent to the database per request',
+    labels=('endpoint', 'method'), buckets=QUERY_BUCKETS)
+request_db_seconds = registry.histogram(
+    'http_request_db_seconds', 'Time spent in the database per request',
+    labels=('endpoint', 'method'))
+request_auth_seconds = registry.histogram(
+    'http_request_auth_seconds', 'Time spent verifying the token',
+    labels=('endpoint', 'method'))
+request_serialize_seconds = registry.histogram(
+    'http_request_serialize_seconds', 'Time spent encoding JSON',
+    labels=('endpoint', 'method'))
+slow_queries = registry.counter(
+    'db_slow_queries_total',
+    'Statements slower than SLOW_QUERY_SECONDS',
+    labels=('endpoint',))
+
+
+class RequestProfile:
+    """Database, auth and serialization time of the current request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = (0.0, None)
+        self.timings = {'auth': 0.0, 'serialize': 0.0}
+
+    def add_query(self, statement, seconds):
+        self.queries += 1
+        self.db_time += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+    def server_timing(self):
+        entries = [('db', self.db_time, f'{self.queries} queries'),
+                   ('db-slowest', self.slowest[0], None),
+                   ('auth', self.timings['auth'], None),
+                   ('serialize', self.timings['serialize'], None),
+                   ('total', time.perf_counter() - self.start, None)]
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.2f}' +
+            (f';desc="{description}"' if description else '')
+            for name, seconds, description in entries)
+
+
+def current_profile():
+    if has_request_context():
+        return g.get('profile')
+    return None
+
+
+'''
+profiled(name)
+    adds the time spent in the block to the current request's timing
+    `name`; a no-op outside requests or when profiling is off
+'''
+
+
+@contextmanager
+def profiled(name):
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.timings[name] += time.perf_counter() - start
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    seconds = time.perf_counter() - conn.info['query_start'].pop()
+    profile = current_profile()
+    if profile is None:
+        return
+    profile.add_query(statement, seconds)
+    if seconds >= SLOW_QUERY_SECONDS:
+        slow_queries.inc(endpoint=request.endpoint or 'unmatched')
+        logger.warning('slow query (%.3fs) in %s %s: %s', seconds,
+                       request.method, request.path, statement)
+
+
+def handle_error(context):
+    if context.connection is not None and \
+            context.connection.info.get('query_start'):
+        context.connection.info['query_start'].pop()
+
+
+def profiled_encoder(encoder):
+    class ProfiledJSONEncoder(encoder):
+        def encode(self, o):
+            with profiled('serialize'):
+                return super().encode(o)
+
+    return ProfiledJSONEncoder
+
+
+'''
+init_app(app)
+    profiles every request of the app: statement count and database time
+    from cursor events on all engines, token verification and JSON
+    encoding time, sent as a Server-Timing header and aggregated per
+    endpoint in the registry
+'''
+
+
+def init_app(app):
+    if not event.contains(Engine, 'before_cursor_execute',
+                          before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+    app.json_encoder = profiled_encoder(app.json_encoder)
+
+    @app.before_request
+    def start_profile():
+        g.profile = RequestProfile()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return response
+        labels = {'endpoint': request.endpoint or 'unmatched',
+                  'method': request.method}
+        response.headers['Server-Timing'] = profile.server_timing()
+        request_seconds.observe(time.perf_counter() - profile.start,
+                                **labels)
+        request_queries.observe(profile.queries, **labels)
+        request_db_seconds.observe(profile.db_time, **labels)
+        request_auth_seconds.observe(profile.timings['auth'], **labels)
+        request_serialize_seconds.observe(profile.timings['serialize'],
+                                          **labels)
+        return response
@@ -0,0 +1,44 @@
+"""search indexes for movie and actor filters
+
+Revision ID: 12b7be39af01
+Revises: 43ba40d68613
+Create Date: 2026-10-18 10:41:19.873350
+
+The trigram indexes serve the case-insensitive title and name searches
+(ILIKE '%...%' and ILIKE '...%'). They need the pg_trgm extension and are
+only created on Postgres; they are not declared on the models because
+db.create_all() can't create them without the extension.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '12b7be39af01'
+down_revision = '43ba40d68613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_actor_gender', 'actor', ['gender'], unique=False)
+    op.create_index('ix_actor_age', 'actor', ['age'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index('ix_movie_title_trgm', 'movie', ['title'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'title': 'gin_trgm_ops'})
+        op.create_index('ix_actor_name_trgm', 'actor', ['name'],
+                        unique=False, postgresql_using='gin',
+                        postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_actor_name_trgm', table_name='actor')
+        op.drop_index('ix_movie_title_trgm', table_name='movie')
+
+    op.drop_index('ix_actor_age', table_name='actor')
+    op.drop_index('ix_actor_gender', table_name='actor')
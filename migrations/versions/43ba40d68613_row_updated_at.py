@@ -0,0 +1,32 @@
+"""updated_at row versions on movie and actor
+
+Revision ID: 43ba40d68613
+Revises: 4aa3ff9ab11a
+Create Date: 2026-10-18 10:02:47.530126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '43ba40d68613'
+down_revision = '4aa3ff9ab11a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('movie', 'actor'):
+        op.add_column(table, sa.Column(
+            'updated_at', sa.DateTime(), nullable=False,
+            server_default=sa.text("(now() at time zone 'utc')")))
+        op.alter_column(table, 'updated_at', server_default=None)
+        op.create_index(f'ix_{table}_updated_at', table, ['updated_at'],
+                        unique=False)
+
+
+def downgrade():
+    for table in ('movie', 'actor'):
+        op.drop_index(f'ix_{table}_updated_at', table_name=table)
+        op.drop_column(table, 'updated_at')
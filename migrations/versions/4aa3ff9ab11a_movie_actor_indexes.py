@@ -0,0 +1,40 @@
+"""indexes on movie_actor_association and movie.release_date
+
+Revision ID: 4aa3ff9ab11a
+Revises: 8a56e2662d61
+Create Date: 2026-10-18 09:20:04.118364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4aa3ff9ab11a'
+down_revision = '8a56e2662d61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the unique index can't be built while duplicate cast rows exist
+    op.execute(
+        'DELETE FROM movie_actor_association WHERE id NOT IN ('
+        'SELECT MIN(id) FROM movie_actor_association '
+        'GROUP BY movie_id, actor_id)'
+    )
+    op.create_index('ix_movie_actor_association_movie_id_actor_id',
+                    'movie_actor_association', ['movie_id', 'actor_id'],
+                    unique=True)
+    op.create_index('ix_movie_actor_association_actor_id',
+                    'movie_actor_association', ['actor_id'], unique=False)
+    op.create_index('ix_movie_release_date', 'movie', ['release_date'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movie_release_date', table_name='movie')
+    op.drop_index('ix_movie_actor_association_actor_id',
+                  table_name='movie_actor_association')
+    op.drop_index('ix_movie_actor_association_movie_id_actor_id',
+                  table_name='movie_actor_association')
@@ -0,0 +1,27 @@
+"""version counters on movie and actor for If-Match
+
+Revision ID: 6c1f0e9d2b47
+Revises: 12b7be39af01
+Create Date: 2026-10-18 14:12:05.316482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1f0e9d2b47'
+down_revision = '12b7be39af01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('movie', 'actor'):
+        op.add_column(table, sa.Column(
+            'version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in ('movie', 'actor'):
+        op.drop_column(table, 'version')
@@ -0,0 +1,53 @@
+"""initial schema
+
+Revision ID: 8a56e2662d61
+Revises:
+Create Date: 2026-10-18 09:12:31.402911
+
+Databases created by db.create_all() before migrations were introduced
+already have these tables, mark them with `python manage.py db stamp
+8a56e2662d61` instead of upgrading.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a56e2662d61'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'actor',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('gender', sa.String(), nullable=True),
+        sa.Column('age', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'movie',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=True),
+        sa.Column('release_date', sa.Date(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'movie_actor_association',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=True),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['actor_id'], ['actor.id'], ),
+        sa.ForeignKeyConstraint(['movie_id'], ['movie.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('movie_actor_association')
+    op.drop_table('movie')
+    op.drop_table('actor')
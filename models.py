@@ -1,34 +1,224 @@
 from sqlalchemy.ext.declarative import declarative_base
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, joinedload
+import datetime
 import os
-from sqlalchemy import Column, String, Integer, Date, ForeignKey
+import time
+import weakref
+from sqlalchemy import Column, String, Integer, Date, DateTime, ForeignKey
+from sqlalchemy import and_, any_, bindparam, event, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+from metrics import registry
+from replicas import ReplicaRouter, RoutingSQLAlchemy, replica_paths
+from transactions import UnitOfWork
 
 
 Base = declarative_base()
 
 # postgres://localhost:5432/casting
 
-database_path = os.environ['DATABASE_URL']
+database_path = os.environ.get('DATABASE_URL')
+
+# dialects that return the ids of a multi-row INSERT ... VALUES in order
+# and the rows of an UPDATE ... RETURNING
+RETURNING_DIALECTS = ('postgresql',)
+# dialects binding a list of ids as one array for = ANY(...)
+ARRAY_DIALECTS = ('postgresql',)
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', -1))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '') in ('1', 'true')
+
+db = RoutingSQLAlchemy()
+unit_of_work = UnitOfWork(db)
+
+pool_checkout_seconds = registry.histogram(
+    'db_pool_checkout_seconds',
+    'Time spent waiting for a connection from the pool')
+pool_connects = registry.counter(
+    'db_pool_connects_total', 'New connections opened by the pool')
+pool_invalidations = registry.counter(
+    'db_pool_invalidations_total', 'Connections invalidated by the pool')
+pools = weakref.WeakSet()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waits for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pools.add(self)
+        event.listen(self, 'connect', lambda *args: pool_connects.inc())
+        event.listen(self, 'invalidate',
+                     lambda *args: pool_invalidations.inc())
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+registry.gauge('db_pool_size', 'Connections the pools keep open',
+               lambda: sum(pool.size() for pool in pools))
+registry.gauge('db_pool_checked_out', 'Connections currently in use',
+               lambda: sum(pool.checkedout() for pool in pools))
+registry.gauge('db_pool_overflow',
+               'Connections opened beyond the pool size',
+               lambda: sum(max(pool.overflow(), 0) for pool in pools))
+
+
+'''
+engine_options(database_path)
+    pool settings from the DB_POOL_* environment variables; sqlite uses
+    its own single connection pools, so only pre-ping and recycle apply
+'''
+
+
+def engine_options(database_path):
+    options = {
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE
+    }
+    if make_url(database_path).get_backend_name() != 'sqlite':
+        options.update(poolclass=InstrumentedQueuePool,
+                       pool_size=DB_POOL_SIZE,
+                       max_overflow=DB_MAX_OVERFLOW,
+                       pool_timeout=DB_POOL_TIMEOUT)
+    return options
 
-db = SQLAlchemy()
 
 '''
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service; doesn't connect,
+    the schema is created and upgraded by `python manage.py db upgrade`
+
+    replica_paths (DATABASE_REPLICA_URLS) become the binds replica_0,
+    replica_1, ... that views decorated with replicas.replica_reads read
+    from
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
+    if database_path is None:
+        raise RuntimeError('DATABASE_URL is not set')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS",
+                          engine_options(database_path))
+    binds = {f'replica_{index}': path
+             for index, path in enumerate(replica_paths)}
+    app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if binds:
+        ReplicaRouter({name: db.get_engine(app, name)
+                       for name in binds}).init_app(app)
+
+
+'''
+row_version(model)
+    (row count, highest id, sum of the row versions) of the model's table
+    in one query, a validator for the whole table: every update bumps a
+    version, every insert or delete moves the count or the highest id.
+    Unlike timestamps taken by the app at flush time it changes with every
+    commit, whatever order concurrent transactions commit in
+'''
+
+
+def row_version(model):
+    return db.session.query(
+        func.count(model.id), func.coalesce(func.max(model.id), 0),
+        func.coalesce(func.sum(model.version), 0)).one()
+
+
+'''
+detail_version(model, resource_id, related=None)
+    updated_at and version of one row and, when related is given, the
+    count and latest updated_at of the related rows joined through the cast
+    table, all in one query; None when the row doesn't exist
+'''
+
+
+def detail_version(model, resource_id, related=None):
+    if related is None:
+        row = db.session.query(model.updated_at, model.version).filter(
+            model.id == resource_id).one_or_none()
+        return None if row is None else (row.updated_at, row.version, None)
+
+    if model is Movie:
+        own, other = (MovieActorAssociation.movie_id,
+                      MovieActorAssociation.actor_id)
+    else:
+        own, other = (MovieActorAssociation.actor_id,
+                      MovieActorAssociation.movie_id)
+    row = db.session.query(
+        model.updated_at, model.version, func.count(related.id),
+        func.max(related.updated_at)).outerjoin(
+        MovieActorAssociation, own == model.id).outerjoin(
+        related, related.id == other).filter(
+        model.id == resource_id).group_by(
+        model.id, model.updated_at, model.version).one_or_none()
+    return None if row is None else (row[0], row[1], row[2:])
+
+
+'''
+update_row(model, resource_id, values, versions=None)
+    one UPDATE of the row, limited to the given versions when `versions`
+    isn't None, and the updated row: from RETURNING where the database
+    supports it, from a SELECT by id otherwise; None when no row matched
+'''
+
+
+def update_row(model, resource_id, values, versions=None):
+    if versions is not None and not versions:
+        return None
+    table = model.__table__
+    statement = table.update().where(table.c.id == resource_id).values(
+        values)
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+    if db.engine.dialect.name in RETURNING_DIALECTS:
+        return db.session.execute(statement.returning(*table.c)).first()
+    if db.session.execute(statement).rowcount == 0:
+        return None
+    return db.session.execute(select([table]).where(
+        table.c.id == resource_id)).first()
+
+
+'''
+ids_condition(model, ids)
+    model.id among the given ids: = ANY(:ids) with one array parameter
+    where the database supports it, so the statement is the same for any
+    number of ids, IN (...) otherwise
+'''
+
+
+def ids_condition(model, ids):
+    if db.engine.dialect.name in ARRAY_DIALECTS:
+        return model.id == any_(bindparam(
+            'ids', list(ids), type_=ARRAY(Integer)))
+    return model.id.in_(ids)
+
+
+def like_pattern(value, prefix=False):
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace(
+        '_', '\\_')
+    return escaped + '%' if prefix else '%' + escaped + '%'
 
 
 class MovieActorAssociation(db.Model):
-    __table_name__ = "movie_actor_association"
+    __tablename__ = "movie_actor_association"
+    __table_args__ = (
+        db.Index('ix_movie_actor_association_movie_id_actor_id',
+                 'movie_id', 'actor_id', unique=True),
+        db.Index('ix_movie_actor_association_actor_id', 'actor_id'),
+    )
 
     id = db.Column(Integer, primary_key=True)
     movie_id = Column(Integer, ForeignKey('movie.id'))
@@ -37,10 +227,24 @@ class MovieActorAssociation(db.Model):
 
 class Movie(db.Model):
     __tablename__ = 'movie'
+    fields = ('id', 'title', 'release_date', 'actors')
+    filters = {
+        'title': str,
+        'title_prefix': str,
+        'released_from': datetime.date,
+        'released_to': datetime.date,
+        'actor': int
+    }
 
     id = Column(Integer, primary_key=True)
     title = Column(String)
-    release_date = Column(Date)
+    release_date = Column(Date, index=True)
+    updated_at = Column(DateTime, nullable=False, index=True,
+                        default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+    # bumped by every UPDATE, ORM or Core, for If-Match
+    version = Column(Integer, nullable=False, default=1, server_default='1',
+                     onupdate=text('version + 1'))
     actors = relationship("Actor",
                           secondary="movie_actor_association",
                           backref="movies")
@@ -51,31 +255,185 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        unit_of_work.commit('movies')
 
     def update(self):
-        db.session.commit()
+        unit_of_work.commit('movies')
+
+    @classmethod
+    def patch(cls, movie_id, values, actor_ids=None, versions=None):
+        '''
+        updates the movie in one statement (see update_row) and sets its
+        cast; the updated row, or None when no row matched
+        '''
+        row = update_row(cls, movie_id, values, versions)
+        if row is None:
+            return None
+        if actor_ids is not None:
+            cls.sync_casts({movie_id: actor_ids}, touch=False)
+        unit_of_work.commit('movies')
+        return row
 
     def delete(self):
         db.session.delete(self)
-        db.session.commit()
+        unit_of_work.commit('movies')
 
-    def format(self):
+    def format(self, actor_ids=None):
+        if actor_ids is None:
+            actor_ids = [actor.id for actor in self.actors]
         return {
             'id': self.id,
             'title': self.title,
             'release_date': self.release_date,
-            'actors': [actor.id for actor in self.actors]
+            'actors': actor_ids
         }
 
+    @classmethod
+    def actor_ids_by_movie(cls, movie_ids):
+        if isinstance(movie_ids, list) and not movie_ids:
+            return {}
+        return cls.group_casts(db.session.execute(
+            cls.cast_statement(movie_ids)))
+
+    @staticmethod
+    def cast_statement(movie_ids):
+        association = MovieActorAssociation.__table__
+        return select([association.c.movie_id,
+                       association.c.actor_id]).where(
+            association.c.movie_id.in_(movie_ids)).order_by(
+            association.c.id)
+
+    @staticmethod
+    def group_casts(rows):
+        actor_ids = {}
+        for movie_id, actor_id in rows:
+            actor_ids.setdefault(movie_id, []).append(actor_id)
+        return actor_ids
+
+    @classmethod
+    def sync_casts(cls, casts, touch=True):
+        '''
+        brings every cast in casts ({movie_id: actor_ids}) in line with the
+        given actor ids, writing only the association rows that changed;
+        touch=False when the movies were just updated anyway
+        '''
+        current = cls.actor_ids_by_movie(list(casts))
+        added, removed = [], []
+        for movie_id, actor_ids in casts.items():
+            before = set(current.get(movie_id, []))
+            after = set(actor_ids)
+            added.extend((movie_id, actor_id)
+                         for actor_id in sorted(after - before))
+            removed.extend((movie_id, actor_id)
+                           for actor_id in sorted(before - after))
+        cls.change_casts(added, removed, touch)
+
+    @classmethod
+    def touch(cls, movie_ids):
+        if not movie_ids:
+            return
+        db.session.execute(cls.__table__.update().where(
+            cls.__table__.c.id.in_(movie_ids)).values(
+            updated_at=datetime.datetime.utcnow()))
+
+    @classmethod
+    def change_casts(cls, added, removed, touch=True):
+        if touch:
+            cls.touch(sorted({movie_id for movie_id, _ in added + removed}))
+        association = MovieActorAssociation.__table__
+        if removed:
+            db.session.execute(association.delete().where(and_(
+                association.c.movie_id == bindparam('_movie_id'),
+                association.c.actor_id == bindparam('_actor_id'))), [
+                {'_movie_id': movie_id, '_actor_id': actor_id}
+                for movie_id, actor_id in removed])
+        if added:
+            db.session.execute(association.insert(), [
+                {'movie_id': movie_id, 'actor_id': actor_id}
+                for movie_id, actor_id in added])
+
+    def set_actors(self, actor_ids):
+        self.sync_casts({self.id: actor_ids})
+
+    def change_actors(self, add=(), remove=()):
+        current = set(self.actor_ids_by_movie([self.id]).get(self.id, []))
+        added = sorted(set(add) - current)
+        removed = sorted(set(remove) & current)
+        self.change_casts([(self.id, actor_id) for actor_id in added],
+                          [(self.id, actor_id) for actor_id in removed])
+
+    @classmethod
+    def apply_filters(cls, query, filters):
+        '''
+        title searches are served by the trigram index on movie.title (see
+        the search indexes migration), the rest by plain b-tree indexes
+        '''
+        if 'title' in filters:
+            query = query.filter(cls.title.ilike(
+                like_pattern(filters['title']), escape='\\'))
+        if 'title_prefix' in filters:
+            query = query.filter(cls.title.ilike(
+                like_pattern(filters['title_prefix'], prefix=True),
+                escape='\\'))
+        if 'released_from' in filters:
+            query = query.filter(cls.release_date >= filters['released_from'])
+        if 'released_to' in filters:
+            query = query.filter(cls.release_date <= filters['released_to'])
+        if 'actor' in filters:
+            query = query.filter(cls.id.in_(db.session.query(
+                MovieActorAssociation.movie_id).filter(
+                MovieActorAssociation.actor_id == filters['actor'])))
+        return query
+
+    @classmethod
+    def get_detail(cls, movie_id, include_actors=False):
+        if not include_actors:
+            movie = cls.query.get(movie_id)
+            return None if movie is None else cls.format_all([movie])[0]
+        movie = cls.query.options(joinedload(cls.actors)).filter(
+            cls.id == movie_id).one_or_none()
+        if movie is None:
+            return None
+        return dict(movie.format([]), actors=Actor.format_all(movie.actors))
+
+    @classmethod
+    def format_all(cls, movies):
+        actor_ids = cls.actor_ids_by_movie([movie.id for movie in movies])
+        return [movie.format(actor_ids.get(movie.id, []))
+                for movie in movies]
+
+    @classmethod
+    def format_rows(cls, rows, fields, actor_ids=None):
+        if actor_ids is None and 'actors' in fields:
+            actor_ids = cls.actor_ids_by_movie([row.id for row in rows])
+        actor_ids = actor_ids or {}
+        return [{
+            field: actor_ids.get(row.id, []) if field == 'actors'
+            else getattr(row, field) for field in fields
+        } for row in rows]
+
 
 class Actor(db.Model):
     __tablename__ = 'actor'
+    fields = ('id', 'name', 'gender', 'age')
+    filters = {
+        'name': str,
+        'gender': str,
+        'min_age': int,
+        'max_age': int,
+        'appeared_from': datetime.date
+    }
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    gender = Column(String)
-    age = Column(Integer)
+    gender = Column(String, index=True)
+    age = Column(Integer, index=True)
+    updated_at = Column(DateTime, nullable=False, index=True,
+                        default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+    # bumped by every UPDATE, ORM or Core, for If-Match
+    version = Column(Integer, nullable=False, default=1, server_default='1',
+                     onupdate=text('version + 1'))
 
     def __init__(self, name, gender, age):
         self.name = name
@@ -84,14 +442,25 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
-        db.session.commit()
+        unit_of_work.commit('actors')
 
     def update(self):
-        db.session.commit()
+        unit_of_work.commit('actors')
+
+    @classmethod
+    def patch(cls, actor_id, values, versions=None):
+        row = update_row(cls, actor_id, values, versions)
+        if row is not None:
+            unit_of_work.commit('actors')
+        return row
 
     def delete(self):
+        # the movies this actor played in lose a cast member
+        Movie.touch([movie_id for movie_id, in db.session.query(
+            MovieActorAssociation.movie_id).filter(
+            MovieActorAssociation.actor_id == self.id)])
         db.session.delete(self)
-        db.session.commit()
+        unit_of_work.commit('actors', 'movies')
 
     def format(self):
         return {
@@ -100,3 +469,42 @@ class Actor(db.Model):
             'age': self.age,
             'gender': self.gender
         }
+
+    @classmethod
+    def apply_filters(cls, query, filters):
+        if 'name' in filters:
+            query = query.filter(cls.name.ilike(
+                like_pattern(filters['name']), escape='\\'))
+        if 'gender' in filters:
+            query = query.filter(cls.gender == filters['gender'])
+        if 'min_age' in filters:
+            query = query.filter(cls.age >= filters['min_age'])
+        if 'max_age' in filters:
+            query = query.filter(cls.age <= filters['max_age'])
+        if 'appeared_from' in filters:
+            query = query.filter(cls.id.in_(db.session.query(
+                MovieActorAssociation.actor_id).join(
+                Movie, Movie.id == MovieActorAssociation.movie_id).filter(
+                Movie.release_date >= filters['appeared_from'])))
+        return query
+
+    @classmethod
+    def get_detail(cls, actor_id, include_movies=False):
+        if not include_movies:
+            actor = cls.query.get(actor_id)
+            return None if actor is None else actor.format()
+        actor = cls.query.options(joinedload(cls.movies)).filter(
+            cls.id == actor_id).one_or_none()
+        if actor is None:
+            return None
+        movies = sorted(actor.movies, key=lambda movie: movie.id)
+        return dict(actor.format(), movies=Movie.format_all(movies))
+
+    @classmethod
+    def format_all(cls, actors):
+        return [actor.format() for actor in actors]
+
+    @classmethod
+    def format_rows(cls, rows, fields):
+        return [{field: getattr(row, field) for field in fields}
+                for row in rows]
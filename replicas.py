@@ -0,0 +1,201 @@
+'''
+replicas.py
+    routes the reads of GET requests to read replicas
+
+    DATABASE_REPLICA_URLS=postgres://replica-1/casting,postgres://replica-2/...
+
+    Views decorated with replica_reads run their queries on a replica
+    chosen per request, round robin or by the fewest connections in use
+    (REPLICA_SELECTION). Everything else, and every flush, stays on the
+    primary. After a client commits a write its reads go to the primary
+    for REPLICA_STICKY_SECONDS, so it reads its own writes despite the
+    replication lag. A replica that can't be connected to is skipped for
+    REPLICA_RETRY_SECONDS and the request falls back to the next replica
+    or to the primary.
+'''
+import itertools
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from jose import jwt
+from sqlalchemy import event, exc, orm
+
+from metrics import registry
+
+
+replica_paths = [url for url in os.environ.get(
+    'DATABASE_REPLICA_URLS', '').split(',') if url]
+REPLICA_SELECTION = os.environ.get('REPLICA_SELECTION', 'round_robin')
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+replica_reads_total = registry.counter(
+    'db_replica_reads_total', 'Requests whose reads went to each database',
+    labels=('database',))
+replica_failures_total = registry.counter(
+    'db_replica_failures_total', 'Replicas found unreachable',
+    labels=('database',))
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the statements of a replica_reads view to its
+    replica; flushes always go to the primary"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and has_app_context():
+            replica = g.get('replica')
+            if replica is not None:
+                return replica.engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def remember_write(session):
+    if has_app_context():
+        g.replica_wrote = True
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.in_use = 0
+        self.retry_at = 0.0
+        event.listen(engine, 'checkout', self.checked_out)
+        event.listen(engine, 'checkin', self.checked_in)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def checked_out(self, dbapi_connection, record, proxy):
+        self.in_use += 1
+
+    def checked_in(self, dbapi_connection, record):
+        self.in_use -= 1
+
+    def handle_error(self, context):
+        if context.is_disconnect:
+            self.fail()
+
+    def healthy(self):
+        return self.retry_at <= time.monotonic()
+
+    def fail(self):
+        self.retry_at = time.monotonic() + REPLICA_RETRY_SECONDS
+        replica_failures_total.inc(database=self.name)
+
+    def available(self):
+        '''
+        whether a connection can be checked out, marks the replica as
+        failed otherwise; a pool hit costs no round trip
+        '''
+        try:
+            self.engine.connect().close()
+        except exc.DBAPIError:
+            self.fail()
+            return False
+        return True
+
+
+class ReplicaRouter:
+    '''
+    chooses the replica of a read request, or None for the primary; the
+    clients that wrote recently are remembered per process, like the
+    memory cache backend, so with several workers a client only reads its
+    writes on the worker that handled the write
+    '''
+
+    def __init__(self, engines, selection=REPLICA_SELECTION,
+                 sticky_seconds=REPLICA_STICKY_SECONDS):
+        if selection not in ('round_robin', 'least_loaded'):
+            raise ValueError(f'unknown REPLICA_SELECTION {selection!r}')
+        self.replicas = [Replica(name, engine)
+                         for name, engine in engines.items()]
+        self.selection = selection
+        self.sticky_seconds = sticky_seconds
+        self._turns = itertools.count()
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['replicas'] = self
+        app.after_request(self.after_request)
+
+    def candidates(self):
+        start = next(self._turns) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        if self.selection == 'least_loaded':
+            # stable, so equally loaded replicas still take turns
+            ordered.sort(key=lambda replica: replica.in_use)
+        return ordered
+
+    def choose(self, client=None):
+        if client is not None and self.wrote_recently(client):
+            return None
+        for replica in self.candidates():
+            if replica.healthy() and replica.available():
+                return replica
+        return None
+
+    def wrote_recently(self, client):
+        until = self._writers.get(client)
+        if until is None:
+            return False
+        if until > time.monotonic():
+            return True
+        with self._lock:
+            self._writers.pop(client, None)
+        return False
+
+    def record_write(self, client):
+        with self._lock:
+            self._writers[client] = time.monotonic() + self.sticky_seconds
+
+    def after_request(self, response):
+        if g.pop('replica_wrote', False):
+            client = request_client()
+            if client is not None:
+                self.record_write(client)
+        return response
+
+
+def request_client():
+    '''
+    the subject of the request's token; only used to route reads, the
+    token itself was verified by requires_auth
+    '''
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2:
+        return None
+    try:
+        return jwt.get_unverified_claims(auth[1]).get('sub')
+    except jwt.JWTError:
+        return None
+
+
+'''
+replica_reads(f)
+    for views below requires_auth: runs the view's queries, including
+    those of the conditional and cache decorators under it, on a replica
+    unless the token's subject wrote within REPLICA_STICKY_SECONDS
+'''
+
+
+def replica_reads(f):
+    @wraps(f)
+    def wrapper(token, *args, **kwargs):
+        router = current_app.extensions.get('replicas')
+        if router is not None:
+            g.replica = router.choose(token.get('sub'))
+            replica_reads_total.inc(database='primary' if g.replica is None
+                                    else g.replica.name)
+        return f(token, *args, **kwargs)
+
+    return wrapper
@@ -1,58 +1,32 @@
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
 
-from app import create_app
-from models import setup_db
-
-import requests
-
-# testing user password database:
-testingUsers = {
-    'messing.maximilian+executive@gmail.com': 'executive123!',
-    'messing.maximilian+director@gmail.com': 'director123!',
-    'messing.maximilian+assistant@gmail.com': 'assistant123!',
-}
-
-# Taken from https://stackoverflow.com/questions/48552474/
-# auth0-obtain-access-token-for-unit-tests-in-python/48554119#48554119
-
-
-def getUserToken(userName):
-    url = 'https://wcp.eu.auth0.com/oauth/token'
-    headers = {'content-type': 'application/json'}
-    client_secret =\
-        "0L9AdpWZfeXfXAqUOflWqXEWur7fFGPTO_bmxBj4R4M-RN14MISOCOgNvmqA-t80"
-    password = testingUsers[userName]
-    parameter = {"client_id": "UEjRDlMUtQ4GLe5wiKgTRfALDsk35Gee",
-                 "client_secret": client_secret,
-                 "audience": 'casting',
-                 "grant_type": "password",
-                 "username": userName,
-                 "password": password, "scope": "openid"}
-    # do the equivalent of a CURL request from https://auth0.com/docs/
-    # quickstart/
-    # backend/python/02-using#obtaining-an-access-token-for-testing
-    responseDICT = json.loads(requests.post(
-        url, json=parameter, headers=headers).text)
-    return responseDICT['access_token']
-
-
-def getUserTokenHeaders(userName='testingUser2@funnymail.com'):
-    return {'authorization': "Bearer " + getUserToken(userName)}
+from app import MAX_IDS, encode_cursor
+from testing import APITestCase, LocalIssuer, TestDatabase
 
 
 class CastingTestCase(unittest.TestCase):
     """This class represents the casting test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """One database for the class: the numbered tests build on each
+        other's writes, everything is rolled back afterwards"""
+        cls.issuer = LocalIssuer()
+        cls.issuer.install()
+        cls.database = TestDatabase()
+        cls.database.begin()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.database.rollback()
+        cls.database.close()
+        cls.issuer.uninstall()
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        self.app = self.database.app
         self.client = self.app.test_client
-        self.database_name = "casting_test"
-        self.database_path = "postgres://{}/{}".format(
-            'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
         self.new_actor = {'name': 'Maximilian Messing',
                           'age': 25,
@@ -70,16 +44,9 @@ class CastingTestCase(unittest.TestCase):
                                   'release_date': "hey there",
                                   'actors': [1],
                                   }
-        self.auth_header_executive = AUTH_HEADER_EXECUTIVE
-        self.auth_header_director = AUTH_HEADER_DIRECTOR
-        self.auth_header_assistant = AUTH_HEADER_ASSISTANT
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+        self.auth_header_executive = self.issuer.headers('executive')
+        self.auth_header_director = self.issuer.headers('director')
+        self.auth_header_assistant = self.issuer.headers('assistant')
 
     def tearDown(self):
         """Executed after reach test"""
@@ -156,6 +123,109 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(len(data['movies']), 1)
 
+    def test_2_get_movies_paginated(self):
+        res = self.client().get('movies?limit=1',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['movies']), 1)
+        self.assertEqual(data['next_cursor'], None)
+
+    def test_2_get_actors_fields(self):
+        res = self.client().get('actors?fields=name',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(list(data['actors'][0].keys()), ['name'])
+
+    def test_2_get_movies_streamed(self):
+        res = self.client().get('movies?stream=json',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['movies']), 1)
+
+    def test_2_get_actors_ndjson(self):
+        res = self.client().get('actors?stream=ndjson',
+                                headers=self.auth_header_executive)
+        lines = res.data.decode('utf-8').splitlines()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['id'], 1)
+
+    def test_get_actors_streamed_with_limit_yield_400(self):
+        res = self.client().get('actors?stream=json&limit=10',
+                                headers=self.auth_header_executive)
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_2_get_movie_with_actors(self):
+        res = self.client().get('movies/1?include=actors',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['movie']['id'], 1)
+        self.assertEqual(data['movie']['actors'][0]['id'], 1)
+
+    def test_2_get_actor_not_modified(self):
+        res = self.client().get('actors/1',
+                                headers=self.auth_header_executive)
+        etag = res.headers['ETag']
+        res = self.client().get('actors/1',
+                                headers=dict(self.auth_header_executive,
+                                             **{'If-None-Match': etag}))
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_non_existing_actor_yield_404(self):
+        res = self.client().get('actors/5',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], "Resource was not found")
+
+    def test_get_movies_invalid_limit_yield_400(self):
+        res = self.client().get('movies?limit=0',
+                                headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], "Bad request")
+
+    def test_get_actors_out_of_range_cursor_yield_400(self):
+        for after in ('99999999999999999999', encode_cursor(1e400),
+                      encode_cursor(2 ** 31)):
+            res = self.client().get(f'actors?after={after}',
+                                    headers=self.auth_header_executive)
+            self.assertEqual(res.status_code, 400, after)
+
+    def test_out_of_range_integer_filters_yield_400(self):
+        for query in ('movies?actor=99999999999999999999',
+                      'actors?min_age=-99999999999999999999',
+                      'actors?max_age=2147483648'):
+            res = self.client().get(query,
+                                    headers=self.auth_header_executive)
+            self.assertEqual(res.status_code, 400, query)
+
+    def test_get_actors_non_ascii_digits_yield_400(self):
+        for query in ('limit=%C2%B2', 'limit=%D9%A3', 'after=%C2%B2'):
+            res = self.client().get(f'actors?{query}',
+                                    headers=self.auth_header_executive)
+            self.assertEqual(res.status_code, 400, query)
+
     def test_patch_non_existing_actor_yield_404(self):
         res = self.client().patch('actors/5', json=self.new_actor,
                                   headers=self.auth_header_executive)
@@ -186,6 +256,22 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertEqual(len(data['actors']), 1)
 
+    def test_2_patch_actors_minimal(self):
+        res = self.client().patch('actors/1',
+                                  json={'name': 'Maximilian Messing',
+                                        'age': 25,
+                                        'gender': 'male',
+                                        },
+                                  headers=dict(self.auth_header_executive,
+                                               Prefer='return=minimal'))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['id'], 1)
+        self.assertEqual(data['actor']['name'], 'Maximilian Messing')
+        self.assertNotIn('actors', data)
+
     def test_2_patch_movies(self):
         res = self.client().patch('movies/1',
                                   json={'title': 'Terminator',
@@ -265,9 +351,11 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertEqual(len(data['actors']), 1)
+        # sqlite reuses the id of the actor deleted before, Postgres doesn't
+        type(self).director_actor_id = data['actors'][0]['id']
 
     def test_5_delete_actor_director(self):
-        res = self.client().delete('actors/2',
+        res = self.client().delete(f'actors/{self.director_actor_id}',
                                    headers=self.auth_header_director)
         data = json.loads(res.data)
 
@@ -284,15 +372,266 @@ class CastingTestCase(unittest.TestCase):
         self.assertEqual(data['description'], "Permission not found.")
         self.assertEqual(data['code'], "unauthorized")
 
+    # Bulk endpoints
+
+    def test_6_bulk_post_actors(self):
+        res = self.client().post('actors/bulk',
+                                 json=[self.new_actor, self.new_invalid_actor],
+                                 headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['failed'], 1)
+        self.assertEqual(data['results'][0]['status'], 'created')
+        self.assertEqual(data['results'][1]['status'], 'invalid')
+
+    def test_bulk_post_movies_not_a_list_yield_400(self):
+        res = self.client().post('movies/bulk', json=self.new_movie,
+                                 headers=self.auth_header_executive)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], "Bad request")
+
+
+class HarnessTestCase(APITestCase):
+    """Per-test rollback and locally signed tokens"""
+
+    def post_actor(self):
+        return self.client().post('actors', json={
+            'name': 'Maximilian Messing', 'age': 25, 'gender': 'male'
+        }, headers=self.headers)
+
+    def test_writes_are_rolled_back(self):
+        # the other tests of the class post actors too
+        res = self.client().get('actors', headers=self.headers)
+        self.assertEqual(res.status_code, 404)
+
+        self.assertEqual(self.post_actor().status_code, 200)
+        res = self.client().get('actors', headers=self.headers)
+        self.assertEqual(len(json.loads(res.data)['actors']), 1)
+
+    def test_requests_continue_after_failed_write(self):
+        self.assertEqual(self.post_actor().status_code, 200)
+        res = self.client().post('movies', json={
+            'title': 'Terminator', 'release_date': 'hey there',
+            'actors': [1]
+        }, headers=self.headers)
+        self.assertEqual(res.status_code, 422)
+
+        res = self.client().get('actors', headers=self.headers)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data)['actors']), 1)
+
+    def test_expired_token_yield_401(self):
+        res = self.client().get('actors', headers=self.issuer.headers(
+            'executive', exp=0))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['code'], 'token_expired')
+
+    def test_wrong_audience_yield_401(self):
+        res = self.client().get('actors', headers=self.issuer.headers(
+            'executive', aud='another-api'))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data['code'], 'invalid_claims')
+
+
+class PatchTestCase(APITestCase):
+    """Single statement PATCH with If-Match"""
+
+    def setUp(self):
+        super().setUp()
+        self.actor = {'name': 'Maximilian Messing', 'age': 25,
+                      'gender': 'male'}
+        res = self.client().post('actors', json=self.actor,
+                                 headers=self.headers)
+        self.actor_id = json.loads(res.data)['actors'][0]['id']
+
+    def patch_actor(self, if_match=None, actor_id=None, **changes):
+        headers = dict(self.headers)
+        if if_match is not None:
+            headers['If-Match'] = if_match
+        return self.client().patch(
+            f'actors/{actor_id or self.actor_id}',
+            json=dict(self.actor, **changes), headers=headers)
+
+    def test_patch_returns_the_new_version(self):
+        res = self.patch_actor(age=26)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['ETag'], f'"actor-{self.actor_id}-v2"')
+        self.assertEqual(json.loads(res.data)['actors'][0]['age'], 26)
+
+    def test_patch_with_current_version(self):
+        res = self.client().get(f'actors/{self.actor_id}',
+                                headers=self.headers)
+        res = self.patch_actor(if_match=res.headers['ETag'], age=26)
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_patch_with_stale_version_yield_412(self):
+        self.patch_actor(age=26)
+        res = self.patch_actor(if_match=f'"actor-{self.actor_id}-v1"',
+                               age=27)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(data['message'], "Precondition failed")
+        res = self.client().get(f'actors/{self.actor_id}',
+                                headers=self.headers)
+        self.assertEqual(json.loads(res.data)['actor']['age'], 26)
+
+    def test_patch_with_non_ascii_version_yield_412(self):
+        res = self.patch_actor(if_match=f'"actor-{self.actor_id}-v\u00b2"',
+                               age=26)
+
+        self.assertEqual(res.status_code, 412)
+
+    def test_patch_non_existing_actor_yield_404(self):
+        for if_match in (None, '"actor-1000-v1"'):
+            res = self.patch_actor(if_match=if_match, actor_id=1000)
+            self.assertEqual(res.status_code, 404)
+
+    def test_patch_invalid_actor_yield_422(self):
+        res = self.patch_actor(age='twenty five')
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_patch_movie_cast_is_one_version(self):
+        res = self.client().post('movies', json={
+            'title': 'Terminator', 'release_date': '2002-12-04',
+            'actors': []
+        }, headers=self.headers)
+        movie_id = json.loads(res.data)['movies'][0]['id']
+
+        res = self.client().patch(f'movies/{movie_id}', json={
+            'title': 'Terminator 2', 'release_date': '2003-12-04',
+            'actors': [self.actor_id]
+        }, headers=dict(self.headers, Prefer='return=minimal',
+                        **{'If-Match': f'"movie-{movie_id}-v1"'}))
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['ETag'], f'"movie-{movie_id}-v2"')
+        self.assertEqual(data['movie']['actors'], [self.actor_id])
+        self.assertEqual(data['movie']['title'], 'Terminator 2')
+
+
+class MultiGetTestCase(APITestCase):
+    """GET /movies and /actors of a list of ids"""
+
+    def setUp(self):
+        super().setUp()
+        self.actor_ids = []
+        for i in range(3):
+            res = self.client().post('actors', json={
+                'name': f'Actor {i}', 'age': 30, 'gender': 'female'
+            }, headers=self.headers)
+            self.actor_ids.append(json.loads(res.data)['actors'][-1]['id'])
+        res = self.client().post('movies', json={
+            'title': 'Terminator', 'release_date': '2002-12-04',
+            'actors': self.actor_ids[1:]
+        }, headers=self.headers)
+        self.movie_id = json.loads(res.data)['movies'][-1]['id']
+
+    def get(self, path, ids, **args):
+        query = '&'.join([f'ids={ids}'] +
+                         [f'{name}={value}' for name, value in args.items()])
+        return self.client().get(f'{path}?{query}', headers=self.headers)
+
+    def test_actors_in_request_order(self):
+        first, second, third = self.actor_ids
+        res = self.get('actors', f'{third},1000,{first},{third}')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor['id'] for actor in data['actors']],
+                         [third, first])
+        self.assertEqual(data['actors'][0], {
+            'id': third, 'name': 'Actor 2', 'age': 30, 'gender': 'female'})
+        self.assertEqual(data['missing'], [1000])
+
+    def test_movies_with_casts_and_fields(self):
+        res = self.get('movies', f'1000,{self.movie_id}',
+                       fields='title,actors')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['movies'], [
+            {'title': 'Terminator', 'actors': self.actor_ids[1:]}])
+        self.assertEqual(data['missing'], [1000])
+
+    def test_only_missing_ids(self):
+        res = self.get('actors', '1000,1001')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['actors'], [])
+        self.assertEqual(data['missing'], [1000, 1001])
+
+    def test_invalid_ids_yield_400(self):
+        too_many = ','.join(str(i) for i in range(1, MAX_IDS + 2))
+        for ids, args in (('', {}), ('1,two', {}), ('-1', {}),
+                          ('%C2%B2', {}), ('1,99999999999999999999', {}),
+                          (too_many, {}),
+                          ('1', {'limit': 10}),
+                          ('1', {'stream': 'json'}), ('1', {'gender': 'm'})):
+            res = self.get('actors', ids, **args)
+            self.assertEqual(res.status_code, 400, (ids, args))
+
+
+class BulkMoviesTestCase(APITestCase):
+    """Updates through POST /movies/bulk"""
+
+    def setUp(self):
+        super().setUp()
+        res = self.client().post('actors', json={
+            'name': 'Maximilian Messing', 'age': 25, 'gender': 'male'
+        }, headers=self.headers)
+        self.actor_id = json.loads(res.data)['actors'][-1]['id']
+        res = self.client().post('movies', json={
+            'title': 'Terminator', 'release_date': '2002-12-04',
+            'actors': [self.actor_id]
+        }, headers=self.headers)
+        self.movie_id = json.loads(res.data)['movies'][-1]['id']
+
+    def bulk_update(self, **changes):
+        record = dict({'id': self.movie_id, 'title': 'Terminator 2',
+                       'release_date': '2003-12-04'}, **changes)
+        res = self.client().post('movies/bulk', json=[record],
+                                 headers=self.headers)
+        self.assertEqual(json.loads(res.data)['updated'], 1)
+        res = self.client().get(f'movies/{self.movie_id}',
+                                headers=self.headers)
+        return json.loads(res.data)['movie']
+
+    def test_update_without_actors_keeps_the_cast(self):
+        movie = self.bulk_update()
+
+        self.assertEqual(movie['title'], 'Terminator 2')
+        self.assertEqual(movie['actors'], [self.actor_id])
+
+    def test_update_with_actors_replaces_the_cast(self):
+        movie = self.bulk_update(actors=[])
+
+        self.assertEqual(movie['actors'], [])
+
+    def test_update_bumps_the_version_once(self):
+        for version, actors in ((2, []), (3, [self.actor_id])):
+            self.bulk_update(actors=actors)
+            res = self.client().get(f'movies/{self.movie_id}',
+                                    headers=self.headers)
+            self.assertEqual(res.headers['ETag'],
+                             f'W/"movie-{self.movie_id}-v{version}"')
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
-    AUTH_HEADER_EXECUTIVE = getUserTokenHeaders(
-        'messing.maximilian+executive@gmail.com')
-    AUTH_HEADER_DIRECTOR = getUserTokenHeaders(
-        'messing.maximilian+director@gmail.com')
-    AUTH_HEADER_ASSISTANT = getUserTokenHeaders(
-        'messing.maximilian+assistant@gmail.com')
-    # You can use the print method to print the token for Testing
-    # print(AUTH_HEADER_EXECUTIVE)
     unittest.main()
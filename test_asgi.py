@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+import auth
+from asgi import CastingApp
+from models import db, Movie, Actor
+
+
+def call(app, path, query_string=b'', method='GET', token='test'):
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path,
+        'query_string': query_string,
+        'headers': [(b'authorization', f'Bearer {token}'.encode())]
+        if token else []
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+class ASGITestCase(unittest.TestCase):
+    """This class represents the ASGI read route test case"""
+
+    def setUp(self):
+        # a file, since every thread of the pool opens its own connection
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = CastingApp(f'sqlite:///{self.path}', backend='executor')
+        self.context = self.app.flask_app.app_context()
+        self.context.push()
+        db.create_all()
+
+        self.actors = [Actor(name=f'Actor {i}', gender='female', age=30)
+                       for i in range(3)]
+        db.session.add_all(self.actors)
+        for i in range(3):
+            movie = Movie(title=f'Movie {i}',
+                          release_date=datetime.date(2002, 12, 4))
+            movie.actors = self.actors[i:]
+            db.session.add(movie)
+        db.session.commit()
+
+        self.verify_decode_jwt = auth.verify_decode_jwt
+        self.permissions = ['get:movies', 'get:actors']
+        auth.verify_decode_jwt = lambda token: {
+            'permissions': self.permissions}
+
+    def tearDown(self):
+        auth.verify_decode_jwt = self.verify_decode_jwt
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(self.app.flask_app).dispose()
+        self.context.pop()
+        self.app.executor.shutdown()
+        os.remove(self.path)
+
+    def expected(self, data):
+        # dates as jsonify sends them
+        with self.app.flask_app.test_request_context():
+            return json.loads(self.app.flask_app.json_encoder().encode(data))
+
+    def test_listings_match_the_models(self):
+        status, body = call(self.app, '/movies')
+        movies = Movie.query.order_by(Movie.id).all()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, self.expected(
+            {'success': True, 'movies': Movie.format_all(movies)}))
+        self.assertEqual(call(self.app, '/actors')[1]['actors'],
+                         [actor.format() for actor in self.actors])
+
+    def test_pagination_fields_and_filters(self):
+        status, body = call(self.app, '/movies',
+                            b'limit=2&fields=title,actors&actor=1')
+
+        self.assertEqual(status, 200)
+        self.assertEqual([(movie['title'], sorted(movie['actors']))
+                          for movie in body['movies']],
+                         [('Movie 0', [1, 2, 3])])
+        self.assertIsNone(body['next_cursor'])
+
+        body = call(self.app, '/actors', b'limit=2')[1]
+        self.assertEqual(len(body['actors']), 2)
+        after = body['next_cursor'].encode()
+        body = call(self.app, '/actors', b'limit=2&after=' + after)[1]
+        self.assertEqual([actor['id'] for actor in body['actors']], [3])
+
+    def test_ids_in_request_order(self):
+        status, body = call(self.app, '/movies', b'ids=3,9,1')
+
+        self.assertEqual(status, 200)
+        self.assertEqual([movie['id'] for movie in body['movies']], [3, 1])
+        self.assertEqual(body['movies'][0], self.expected(
+            Movie.query.get(3).format()))
+        self.assertEqual(body['missing'], [9])
+        self.assertEqual(call(self.app, '/actors', b'ids=2&limit=1')[0], 400)
+
+    def test_details_with_include(self):
+        status, body = call(self.app, '/actors/2', b'include=movies')
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body['actor'], self.expected(
+            Actor.get_detail(2, include_movies=True)))
+        self.assertEqual(call(self.app, '/movies/3', b'include=actors')[1]
+                         ['movie'], self.expected(
+                             Movie.get_detail(3, include_actors=True)))
+        self.assertEqual(call(self.app, '/movies/9')[0], 404)
+
+    def test_errors_use_the_api_shapes(self):
+        self.assertEqual(call(self.app, '/movies', token=None),
+                         (401, {'code': 'authorization_header_missing',
+                                'description':
+                                'Authorization header is expected.'}))
+        self.assertEqual(call(self.app, '/movies', b'limit=0')[1],
+                         {'success': False, 'error': 400,
+                          'message': 'Bad request'})
+        self.assertEqual(call(self.app, '/movies', method='POST')[0], 405)
+
+        self.permissions = ['get:movies']
+        self.assertEqual(call(self.app, '/actors')[0], 403)
+
+
+if __name__ == "__main__":
+    unittest.main()
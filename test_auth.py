@@ -0,0 +1,208 @@
+import unittest
+import threading
+import time
+
+from auth import AuthError, JWKSKeyStore, TokenCache, verify_decode_jwt
+
+
+def make_jwk(kid):
+    return {'kty': 'RSA', 'kid': kid, 'use': 'sig', 'n': 'abc', 'e': 'AQAB'}
+
+
+class FakeFetcher:
+    """Stands in for the identity provider's jwks.json endpoint"""
+
+    def __init__(self, *kids, delay=0):
+        self.kids = list(kids)
+        self.delay = delay
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise OSError('identity provider unreachable')
+        return {'keys': [make_jwk(kid) for kid in self.kids]}
+
+
+class JWKSKeyStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS key store test case"""
+
+    def test_known_kid_is_served_from_memory(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600)
+
+        for _ in range(5):
+            self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+
+        self.assertEqual(fetcher.calls, 1)
+        self.assertEqual(store.stats()['hits'], 5)
+        self.assertEqual(store.stats()['refreshes'], 1)
+
+    def test_unknown_kid_triggers_refetch(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600,
+                             min_refresh_interval=0)
+        store.get_key('key-1')
+
+        fetcher.kids.append('key-2')
+        self.assertEqual(store.get_key('key-2')['kid'], 'key-2')
+        self.assertEqual(fetcher.calls, 2)
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600,
+                             min_refresh_interval=60)
+        store.get_key('key-1')
+
+        for _ in range(5):
+            self.assertIsNone(store.get_key('bogus'))
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_stale_keys_are_served_when_refresh_fails(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=0)
+        store.get_key('key-1')
+
+        fetcher.fail = True
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+        self.assertEqual(store.stats()['refresh_errors'], 1)
+
+    def test_first_fetch_failure_raises_auth_error(self):
+        fetcher = FakeFetcher('key-1')
+        fetcher.fail = True
+        store = JWKSKeyStore(fetcher=fetcher)
+
+        with self.assertRaises(AuthError) as context:
+            store.get_key('key-1')
+        self.assertEqual(context.exception.status_code, 503)
+
+    def test_concurrent_misses_share_one_fetch(self):
+        fetcher = FakeFetcher('key-1', delay=0.05)
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600)
+
+        threads = [threading.Thread(target=store.get_key, args=('key-1',))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_failed_fetch_is_shared_and_backed_off(self):
+        fetcher = FakeFetcher('key-1', delay=0.05)
+        store = JWKSKeyStore(fetcher=fetcher, ttl=0,
+                             min_refresh_interval=60)
+        store.get_key('key-1')
+        fetcher.fail = True
+
+        threads = [threading.Thread(target=store.get_key, args=('key-1',))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetcher.calls, 2)
+
+        # within the backoff the stale keys are served without a fetch
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+        self.assertIsNone(store.get_key('bogus'))
+        self.assertEqual(fetcher.calls, 2)
+
+    def test_failed_first_fetch_is_backed_off(self):
+        fetcher = FakeFetcher('key-1')
+        fetcher.fail = True
+        store = JWKSKeyStore(fetcher=fetcher, min_refresh_interval=60)
+
+        for _ in range(3):
+            with self.assertRaises(AuthError):
+                store.get_key('key-1')
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_stale_keys_are_left_to_the_background_refresh(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600)
+        store.get_key('key-1')
+        store.start_background_refresh(interval=60)
+        store.ttl = 0
+
+        self.assertEqual(store.get_key('key-1')['kid'], 'key-1')
+        store.stop_background_refresh()
+        self.assertEqual(fetcher.calls, 1)
+
+    def test_background_refresh(self):
+        fetcher = FakeFetcher('key-1')
+        store = JWKSKeyStore(fetcher=fetcher, ttl=600)
+        store.get_key('key-1')
+
+        store.start_background_refresh(interval=0.01)
+        time.sleep(0.1)
+        store.stop_background_refresh()
+
+        self.assertGreater(fetcher.calls, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.fetcher = FakeFetcher('key-1')
+        self.store = JWKSKeyStore(fetcher=self.fetcher, ttl=600,
+                                  min_refresh_interval=0)
+        self.rsa_key = self.store.get_key('key-1')
+        self.payload = {'sub': 'user', 'permissions': ['get:movies'],
+                        'exp': time.time() + 3600}
+
+    def test_cached_payload_is_returned(self):
+        cache = TokenCache()
+        cache.set('token', self.payload, self.rsa_key)
+
+        self.assertEqual(cache.get('token', self.store), self.payload)
+        self.assertIsNone(cache.get('other-token', self.store))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    def test_verify_decode_jwt_skips_decoding_on_hit(self):
+        cache = TokenCache()
+        cache.set('not-even-a-jwt', self.payload, self.rsa_key)
+
+        payload = verify_decode_jwt('not-even-a-jwt', key_store=self.store,
+                                    cache=cache)
+        self.assertEqual(payload, self.payload)
+
+    def test_expired_entry_is_evicted(self):
+        cache = TokenCache()
+        self.payload['exp'] = time.time() - 1
+        cache.set('token', self.payload, self.rsa_key)
+
+        self.assertIsNone(cache.get('token', self.store))
+        self.assertEqual(len(cache), 0)
+
+    def test_rotated_key_evicts_entry(self):
+        cache = TokenCache()
+        cache.set('token', self.payload, self.rsa_key)
+
+        self.fetcher.kids = ['key-2']
+        self.store.refresh()
+
+        self.assertIsNone(cache.get('token', self.store))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_least_recently_used_entry_is_dropped(self):
+        cache = TokenCache(maxsize=2)
+        cache.set('a', self.payload, self.rsa_key)
+        cache.set('b', self.payload, self.rsa_key)
+        cache.get('a', self.store)
+        cache.set('c', self.payload, self.rsa_key)
+
+        self.assertIsNotNone(cache.get('a', self.store))
+        self.assertIsNone(cache.get('b', self.store))
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
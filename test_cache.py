@@ -0,0 +1,119 @@
+import datetime
+import unittest
+
+from flask import Flask, jsonify, request
+
+from cache import MemoryBackend, ResponseCache, conditional
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """This class represents the response cache test case"""
+
+    def setUp(self):
+        self.cache = ResponseCache(MemoryBackend(maxsize=8, ttl=60))
+        self.calls = 0
+        self.app = Flask(__name__)
+
+        @self.app.route('/things')
+        @self.cache.cached('things',
+                           bypass=lambda: 'stream' in request.args)
+        def get_things():
+            self.calls += 1
+            return jsonify({'success': True, 'calls': self.calls})
+
+        self.client = self.app.test_client()
+
+    def test_repeat_request_is_served_from_cache(self):
+        first = self.client.get('/things')
+        second = self.client.get('/things')
+
+        self.assertEqual(second.get_json()['calls'], 1)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_query_arguments_are_part_of_the_key(self):
+        self.client.get('/things?limit=1')
+        res = self.client.get('/things?limit=2')
+
+        self.assertEqual(res.get_json()['calls'], 2)
+
+    def test_matching_etag_yields_304(self):
+        etag = self.client.get('/things').headers['ETag']
+        res = self.client.get('/things', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+        self.assertEqual(self.calls, 1)
+
+    def test_invalidate_bumps_the_version(self):
+        etag = self.client.get('/things').headers['ETag']
+        self.cache.invalidate('things')
+        res = self.client.get('/things', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.get_json()['calls'], 2)
+
+    def test_bypass_skips_the_cache(self):
+        self.client.get('/things?stream=json')
+        res = self.client.get('/things?stream=json')
+
+        self.assertEqual(res.get_json()['calls'], 2)
+        self.assertNotIn('ETag', res.headers)
+
+    def test_expired_entries_are_refetched(self):
+        self.cache.backend.ttl = 0
+        self.client.get('/things')
+        res = self.client.get('/things')
+
+        self.assertEqual(res.get_json()['calls'], 2)
+
+
+class ConditionalTestCase(unittest.TestCase):
+    """This class represents the conditional request test case"""
+
+    def setUp(self):
+        self.version = 'v1'
+        self.modified = datetime.datetime(2020, 5, 17, 12, 0, 0)
+        self.calls = 0
+        self.app = Flask(__name__)
+
+        @self.app.route('/thing')
+        @conditional(lambda: (self.version, self.modified))
+        def get_thing():
+            self.calls += 1
+            return jsonify({'success': True})
+
+        self.client = self.app.test_client()
+
+    def test_validators_are_sent(self):
+        res = self.client.get('/thing')
+
+        self.assertEqual(res.headers['ETag'], 'W/"v1"')
+        self.assertEqual(res.headers['Last-Modified'],
+                         'Sun, 17 May 2020 12:00:00 GMT')
+
+    def test_matching_etag_skips_the_view(self):
+        res = self.client.get('/thing', headers={'If-None-Match': 'W/"v1"'})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(self.calls, 0)
+
+    def test_changed_version_runs_the_view(self):
+        self.version = 'v2'
+        res = self.client.get('/thing', headers={'If-None-Match': 'W/"v1"'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.calls, 1)
+
+    def test_if_modified_since(self):
+        headers = {'If-Modified-Since': 'Sun, 17 May 2020 12:00:00 GMT'}
+        self.assertEqual(self.client.get('/thing', headers=headers)
+                         .status_code, 304)
+
+        self.modified += datetime.timedelta(seconds=1)
+        self.assertEqual(self.client.get('/thing', headers=headers)
+                         .status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import unittest
+import zlib
+
+from flask import Flask, Response, jsonify
+
+from cache import MemoryBackend, ResponseCache
+from compression import Compression
+
+GZIP = {'Accept-Encoding': 'gzip'}
+
+
+def gunzip(data):
+    return zlib.decompress(data, 31)
+
+
+class CompressionTestCase(unittest.TestCase):
+    """This class represents the response compression test case"""
+
+    def setUp(self):
+        self.compression = Compression(encodings='gzip', min_size=100)
+        self.app = Flask(__name__)
+        self.compression.init_app(self.app)
+        self.items = [{'id': i, 'name': f'Actor {i}'} for i in range(50)]
+
+        @self.app.route('/items')
+        def get_items():
+            return jsonify({'success': True, 'items': self.items})
+
+        @self.app.route('/small')
+        def get_small():
+            return jsonify({'success': True})
+
+        @self.app.route('/stream')
+        def stream_items():
+            def generate():
+                for item in self.items:
+                    yield json.dumps(item) + '\n'
+            return Response(generate(), mimetype='application/x-ndjson')
+
+        self.client = self.app.test_client()
+
+    def test_large_bodies_are_compressed(self):
+        res = self.client.get('/items', headers=GZIP)
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(res.headers['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(res.headers['Content-Length']), len(res.data))
+        self.assertEqual(json.loads(gunzip(res.data))['items'], self.items)
+
+    def test_small_bodies_are_sent_as_they_are(self):
+        res = self.client.get('/small', headers=GZIP)
+
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(res.get_json(), {'success': True})
+
+    def test_encoding_must_be_accepted(self):
+        for headers in ({}, {'Accept-Encoding': 'gzip;q=0, deflate'},
+                        {'Accept-Encoding': 'identity'}):
+            res = self.client.get('/items', headers=headers)
+            self.assertNotIn('Content-Encoding', res.headers, headers)
+            self.assertEqual(res.get_json()['items'], self.items)
+
+    def test_unavailable_encodings_are_left_out(self):
+        compression = Compression(encodings='gzip,compress')
+
+        self.assertEqual(compression.encodings, ['gzip'])
+
+    def test_streams_are_compressed_per_chunk(self):
+        res = self.client.get('/stream', headers=GZIP, buffered=False)
+        chunks = iter(res.response)
+        decompressor = zlib.decompressobj(31)
+
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', res.headers)
+        # every chunk is flushed, the first decodes on its own
+        self.assertEqual(decompressor.decompress(next(chunks)),
+                         (json.dumps(self.items[0]) + '\n').encode())
+        rest = b''.join(decompressor.decompress(chunk) for chunk in chunks)
+        self.assertEqual(rest.decode().splitlines(),
+                         [json.dumps(item) for item in self.items[1:]])
+
+
+class CachedCompressionTestCase(unittest.TestCase):
+    """Compressed bodies kept by the response cache"""
+
+    def setUp(self):
+        self.cache = ResponseCache(MemoryBackend(maxsize=8, ttl=60))
+        self.compression = Compression(encodings='gzip', min_size=100)
+        self.app = Flask(__name__)
+        self.compression.init_app(self.app)
+        self.calls = 0
+        self.compressed = 0
+
+        compress = self.compression.compress
+
+        def counting_compress(body, encoding):
+            self.compressed += 1
+            return compress(body, encoding)
+        self.compression.compress = counting_compress
+
+        @self.app.route('/things')
+        @self.cache.cached('things')
+        def get_things():
+            self.calls += 1
+            return jsonify({'success': True,
+                            'things': list(range(100))})
+
+        self.client = self.app.test_client()
+
+    def test_repeat_hits_skip_compression(self):
+        first = self.client.get('/things', headers=GZIP)
+        second = self.client.get('/things', headers=GZIP)
+
+        self.assertEqual(second.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(json.loads(gunzip(second.data))['things'],
+                         list(range(100)))
+        self.assertEqual((self.calls, self.compressed), (1, 1))
+
+        res = self.client.get('/things')
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(res.get_json()['things'], list(range(100)))
+        self.assertEqual((self.calls, self.compressed), (1, 1))
+
+    def test_compressed_entries_are_invalidated(self):
+        self.client.get('/things', headers=GZIP)
+        self.cache.invalidate('things')
+        self.client.get('/things', headers=GZIP)
+
+        self.assertEqual((self.calls, self.compressed), (2, 2))
+
+    def test_weak_etag_yields_304(self):
+        etag = self.client.get('/things', headers=GZIP).headers['ETag']
+        res = self.client.get('/things', headers=dict(
+            GZIP, **{'If-None-Match': etag}))
+
+        self.assertTrue(etag.startswith('W/'))
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(self.compressed, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+
+from flask import Flask, jsonify
+from sqlalchemy import create_engine
+
+from metrics import Registry, init_app, profiled, registry
+
+
+class RegistryTestCase(unittest.TestCase):
+    """This class represents the Prometheus text rendering test case"""
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_with_labels(self):
+        counter = self.registry.counter('requests_total', 'Requests',
+                                        labels=('method',))
+        counter.inc(method='GET')
+        counter.inc(2, method='POST')
+
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP requests_total Requests',
+                                     '# TYPE requests_total counter'])
+        self.assertIn('requests_total{method="GET"} 1', lines)
+        self.assertIn('requests_total{method="POST"} 2', lines)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.histogram('wait_seconds', 'Wait',
+                                            buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('wait_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('wait_seconds_bucket{le="1.0"} 2', lines)
+        self.assertIn('wait_seconds_bucket{le="+Inf"} 3', lines)
+        self.assertIn('wait_seconds_sum 5.55', lines)
+        self.assertIn('wait_seconds_count 3', lines)
+
+    def test_gauge_is_read_on_render(self):
+        values = [1]
+        self.registry.gauge('in_use', 'In use', lambda: values[-1])
+        values.append(4)
+
+        self.assertIn('in_use 4', self.registry.render().splitlines())
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """This class represents the per-request profiling test case"""
+
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.app = Flask(__name__)
+        init_app(self.app)
+
+        @self.app.route('/profiled')
+        def get_profiled():
+            with profiled('auth'):
+                pass
+            for _ in range(3):
+                self.engine.execute('SELECT 1')
+            return jsonify({'success': True})
+
+        self.client = self.app.test_client()
+
+    def test_server_timing_header(self):
+        timing = self.client.get('/profiled').headers['Server-Timing']
+        names = [entry.split(';')[0] for entry in timing.split(', ')]
+
+        self.assertEqual(names, ['db', 'db-slowest', 'auth', 'serialize',
+                                 'total'])
+        self.assertIn('desc="3 queries"', timing)
+
+    def query_buckets(self):
+        histogram = registry.metrics['http_request_queries']
+        return {labels: value for name, labels, value in histogram.samples()
+                if 'get_profiled' in labels and name.endswith('_bucket')}
+
+    def test_queries_are_aggregated_per_endpoint(self):
+        before = self.query_buckets()
+        self.client.get('/profiled')
+        self.client.get('/profiled')
+        self.engine.execute('SELECT 1')
+        after = self.query_buckets()
+
+        two, three = ('{endpoint="get_profiled",method="GET",le="%s"}' % le
+                      for le in (2, 3))
+        self.assertEqual(after[two] - before.get(two, 0), 0)
+        self.assertEqual(after[three] - before.get(three, 0), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,297 @@
+import datetime
+import unittest
+
+from flask import Flask
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import setup_db, db, row_version, Movie, Actor
+from models import MovieActorAssociation
+from models import InstrumentedQueuePool, engine_options
+from models import pool_checkout_seconds
+from metrics import registry
+
+
+class QueryCounter:
+    """Counts the statements sent to the database while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, *args):
+        self.count += 1
+        self.statements.append(statement.split()[0])
+
+
+class ModelTestCase(unittest.TestCase):
+    """Base class binding the models to an in-memory sqlite database"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.context = self.app.app_context()
+        self.context.push()
+        setup_db(self.app, 'sqlite://')
+        db.drop_all()
+        db.create_all()
+
+        self.actors = [Actor(name=f'Actor {i}', gender='female', age=30)
+                       for i in range(3)]
+        db.session.add_all(self.actors)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def add_movies(self, count):
+        for i in range(count):
+            movie = Movie(title=f'Movie {i}',
+                          release_date=datetime.date(2002, 12, 4))
+            movie.actors = self.actors
+            db.session.add(movie)
+        db.session.commit()
+        db.session.expire_all()
+
+
+class MovieFormatTestCase(ModelTestCase):
+    """This class represents the model serialization test case"""
+
+    def count_format_all_queries(self):
+        with QueryCounter(db.engine) as counter:
+            movies = Movie.query.order_by(Movie.id).all()
+            formatted = Movie.format_all(movies)
+        return counter.count, formatted
+
+    def test_format_all_matches_format(self):
+        self.add_movies(2)
+        movies = Movie.query.order_by(Movie.id).all()
+
+        self.assertEqual(Movie.format_all(movies),
+                         [movie.format() for movie in movies])
+
+    def test_format_all_query_count_is_constant(self):
+        self.add_movies(2)
+        few_queries, few = self.count_format_all_queries()
+        self.add_movies(20)
+        many_queries, many = self.count_format_all_queries()
+
+        self.assertEqual(len(few), 2)
+        self.assertEqual(len(many), 22)
+        self.assertEqual(few_queries, 2)
+        self.assertEqual(many_queries, few_queries)
+
+
+class MovieCastTestCase(ModelTestCase):
+    """This class represents the cast update test case"""
+
+    def cast_of(self, movie):
+        return sorted(Movie.actor_ids_by_movie([movie.id])[movie.id])
+
+    def test_set_actors_writes_only_the_difference(self):
+        self.add_movies(1)
+        movie = Movie.query.one()
+        extra = Actor(name='Extra', gender='male', age=40)
+        db.session.add(extra)
+        db.session.commit()
+        keep = [actor.id for actor in self.actors[1:]]
+
+        with QueryCounter(db.engine) as counter:
+            movie.set_actors(keep + [extra.id])
+            db.session.commit()
+
+        self.assertEqual(counter.statements.count('DELETE'), 1)
+        self.assertEqual(counter.statements.count('INSERT'), 1)
+        self.assertEqual(self.cast_of(movie), sorted(keep + [extra.id]))
+
+    def test_change_actors_ignores_noops(self):
+        self.add_movies(1)
+        movie = Movie.query.one()
+        first, second = self.actors[0].id, self.actors[1].id
+
+        with QueryCounter(db.engine) as counter:
+            movie.change_actors(add=[first], remove=[])
+        self.assertNotIn('INSERT', counter.statements)
+
+        movie.change_actors(add=[], remove=[first, second])
+        db.session.commit()
+        self.assertEqual(self.cast_of(movie), [self.actors[2].id])
+
+
+class QueryPlanTestCase(ModelTestCase):
+    """Guards that cast and release date lookups stay on their indexes"""
+
+    def plan(self, query):
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        cursor = db.session.connection().connection.cursor()
+        cursor.execute(f'EXPLAIN QUERY PLAN {compiled}',
+                       [compiled.params[name]
+                        for name in compiled.positiontup])
+        return ' '.join(row[-1] for row in cursor.fetchall())
+
+    def test_cast_lookup_uses_movie_actor_index(self):
+        query = db.session.query(MovieActorAssociation.actor_id).filter(
+            MovieActorAssociation.movie_id.in_([1, 2]))
+
+        self.assertIn('ix_movie_actor_association_movie_id_actor_id',
+                      self.plan(query))
+
+    def test_filmography_lookup_uses_actor_index(self):
+        query = db.session.query(MovieActorAssociation.movie_id).filter(
+            MovieActorAssociation.actor_id == 1)
+
+        self.assertIn('ix_movie_actor_association_actor_id',
+                      self.plan(query))
+
+    def test_release_date_range_uses_index(self):
+        query = Movie.query.filter(
+            Movie.release_date >= datetime.date(2000, 1, 1),
+            Movie.release_date < datetime.date(2010, 1, 1))
+
+        self.assertIn('ix_movie_release_date', self.plan(query))
+
+    def test_duplicate_cast_rows_are_rejected(self):
+        movie = Movie(title='Movie', release_date=datetime.date(2002, 12, 4))
+        db.session.add(movie)
+        db.session.commit()
+
+        with self.assertRaises(IntegrityError):
+            Movie.change_casts([(movie.id, self.actors[0].id)] * 2, [])
+
+
+class RowVersionTestCase(ModelTestCase):
+    """This class represents the row version validator test case"""
+
+    def test_insert_update_and_delete_change_the_version(self):
+        versions = [row_version(Actor)]
+        actor = Actor(name='New', gender='male', age=20)
+        actor.insert()
+        versions.append(row_version(Actor))
+        actor.age = 21
+        actor.update()
+        versions.append(row_version(Actor))
+        self.actors[0].delete()
+        versions.append(row_version(Actor))
+
+        self.assertEqual(len(set(versions)), 4)
+
+    def test_update_with_an_older_timestamp_changes_the_version(self):
+        # a transaction that flushed before the last one but commits after
+        before = row_version(Actor)
+        self.actors[0].updated_at = datetime.datetime(2000, 1, 1)
+        self.actors[0].update()
+
+        self.assertNotEqual(row_version(Actor), before)
+
+    def test_cast_changes_change_the_movie_version(self):
+        self.add_movies(1)
+        movie = Movie.query.one()
+        before = row_version(Movie)
+
+        movie.change_actors(remove=[self.actors[0].id])
+        movie.update()
+        after_cast_change = row_version(Movie)
+        self.actors[1].delete()
+
+        self.assertNotEqual(after_cast_change, before)
+        self.assertNotEqual(row_version(Movie), after_cast_change)
+
+
+class FilterTestCase(ModelTestCase):
+    """This class represents the listing filter test case"""
+
+    def filtered(self, model, **filters):
+        query = model.apply_filters(model.query, filters)
+        return [row.id for row in query.order_by(model.id)]
+
+    def test_title_search_escapes_wildcards(self):
+        self.add_movies(2)
+        movie = Movie(title='100% Wolf',
+                      release_date=datetime.date(2020, 1, 1))
+        movie.insert()
+
+        self.assertEqual(self.filtered(Movie, title='0% w'), [movie.id])
+        self.assertEqual(self.filtered(Movie, title_prefix='movie'), [1, 2])
+        self.assertEqual(self.filtered(Movie, title='_'), [])
+
+    def test_filters_across_the_cast(self):
+        self.add_movies(1)
+        late = Movie(title='Late', release_date=datetime.date(2020, 1, 1))
+        late.insert()
+        late.change_actors(add=[self.actors[2].id])
+        late.update()
+
+        self.assertEqual(self.filtered(Movie, actor=self.actors[2].id),
+                         [1, late.id])
+        self.assertEqual(self.filtered(Movie, actor=self.actors[0].id), [1])
+        self.assertEqual(
+            self.filtered(Actor, appeared_from=datetime.date(2010, 1, 1)),
+            [self.actors[2].id])
+
+    def test_actor_ranges(self):
+        self.actors[0].age = 20
+        self.actors[0].gender = 'male'
+        self.actors[0].update()
+
+        self.assertEqual(self.filtered(Actor, max_age=25), [1])
+        self.assertEqual(self.filtered(Actor, min_age=25, gender='female'),
+                         [2, 3])
+
+
+class SetupTestCase(unittest.TestCase):
+    """Guards that binding the app doesn't touch the database"""
+
+    def test_setup_db_creates_no_tables(self):
+        app = Flask(__name__)
+        setup_db(app, 'sqlite://')
+
+        with app.app_context():
+            self.assertEqual(inspect(db.engine).get_table_names(), [])
+
+    def test_setup_db_needs_a_database_url(self):
+        with self.assertRaises(RuntimeError):
+            setup_db(Flask(__name__), None)
+
+
+class PoolTestCase(unittest.TestCase):
+    """This class represents the connection pool instrumentation test case"""
+
+    def test_engine_options(self):
+        postgres = engine_options('postgresql://localhost:5432/casting')
+        sqlite = engine_options('sqlite://')
+
+        self.assertIs(postgres['poolclass'], InstrumentedQueuePool)
+        self.assertIn('pool_size', postgres)
+        self.assertNotIn('pool_size', sqlite)
+        self.assertIn('pool_pre_ping', sqlite)
+
+    def test_checkouts_are_exported(self):
+        engine = create_engine('sqlite://', poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=1)
+        waits = pool_checkout_seconds.samples
+        before = dict((name, value) for name, _, value in waits())
+
+        first, second = engine.connect(), engine.connect()
+        lines = registry.render().splitlines()
+        first.close()
+        second.close()
+
+        after = dict((name, value) for name, _, value in waits())
+        self.assertIn('db_pool_checked_out 2', lines)
+        self.assertIn('db_pool_overflow 1', lines)
+        self.assertEqual(after['db_pool_checkout_seconds_count'] -
+                         before.get('db_pool_checkout_seconds_count', 0), 2)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
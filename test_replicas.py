@@ -0,0 +1,133 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from cache import response_cache
+from models import db, Actor
+from replicas import ReplicaRouter
+from testing import LocalIssuer
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """Reads of GET requests on replica database files"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.issuer = LocalIssuer()
+        self.issuer.install()
+        self.backend = response_cache.backend
+        response_cache.backend = None
+
+    def tearDown(self):
+        response_cache.backend = self.backend
+        self.issuer.uninstall()
+        shutil.rmtree(self.directory)
+
+    def database(self, name, actor=None):
+        '''
+        the url of a database file and the one actor make_app() seeds it
+        with, so a response shows which database it was read from
+        '''
+        path = 'sqlite:///' + os.path.join(self.directory, name + '.db')
+        return path, actor
+
+    def make_app(self, primary, *replicas, **config):
+        paths = [path for path, _ in (primary,) + replicas]
+        app = create_app(dict(config, SQLALCHEMY_DATABASE_URI=paths[0],
+                              SQLALCHEMY_REPLICA_URIS=paths[1:]))
+        with app.app_context():
+            binds = [None] + [f'replica_{index}'
+                              for index in range(len(replicas))]
+            for bind, (_, actor) in zip(binds, (primary,) + replicas):
+                if actor is None:
+                    continue
+                engine = db.get_engine(app, bind)
+                db.Model.metadata.create_all(engine)
+                engine.execute(Actor.__table__.insert(), name=actor,
+                               gender='female', age=30)
+        return app
+
+    def names(self, app, role='assistant'):
+        res = app.test_client().get('/actors',
+                                    headers=self.issuer.headers(role))
+        self.assertEqual(res.status_code, 200)
+        return [actor['name'] for actor in json.loads(res.data)['actors']]
+
+    def test_get_reads_from_replica(self):
+        app = self.make_app(self.database('primary', 'Primary'),
+                            self.database('replica', 'Replica'))
+        self.assertEqual(self.names(app), ['Replica'])
+
+    def test_replicas_take_turns(self):
+        app = self.make_app(self.database('primary', 'Primary'),
+                            self.database('first', 'First'),
+                            self.database('second', 'Second'))
+        names = [self.names(app)[0] for _ in range(4)]
+        self.assertEqual(names, ['First', 'Second', 'First', 'Second'])
+
+    def test_writes_go_to_primary_and_stick(self):
+        app = self.make_app(self.database('primary', 'Primary'),
+                            self.database('replica', 'Replica'))
+        res = app.test_client().post('/actors', json={
+            'name': 'New', 'gender': 'male', 'age': 25
+        }, headers=self.issuer.headers('executive'))
+        self.assertEqual(res.status_code, 200)
+
+        # the writer reads its write, everybody else keeps the replica
+        self.assertEqual(self.names(app, 'executive'), ['Primary', 'New'])
+        self.assertEqual(self.names(app, 'assistant'), ['Replica'])
+
+        app.extensions['replicas'].sticky_seconds = 0
+        app.test_client().post('/actors', json={
+            'name': 'Newer', 'gender': 'male', 'age': 25
+        }, headers=self.issuer.headers('executive'))
+        self.assertEqual(self.names(app, 'executive'), ['Replica'])
+
+    def test_unreachable_replica_falls_back(self):
+        missing = ('sqlite:///' + os.path.join(
+            self.directory, 'missing', 'replica.db'), None)
+        app = self.make_app(self.database('primary', 'Primary'), missing)
+        self.assertEqual(self.names(app), ['Primary'])
+
+        router = app.extensions['replicas']
+        self.assertFalse(router.replicas[0].healthy())
+
+    def test_unreachable_replica_is_skipped(self):
+        missing = ('sqlite:///' + os.path.join(
+            self.directory, 'missing', 'replica.db'), None)
+        app = self.make_app(self.database('primary', 'Primary'), missing,
+                            self.database('replica', 'Replica'))
+        self.assertEqual([self.names(app)[0] for _ in range(3)],
+                         ['Replica'] * 3)
+
+
+class RouterTestCase(unittest.TestCase):
+    """Replica selection"""
+
+    def setUp(self):
+        self.engines = {}
+        for name in ('a', 'b', 'c'):
+            self.engines[name] = db.create_engine('sqlite://', {})
+
+    def test_least_loaded(self):
+        router = ReplicaRouter(self.engines, selection='least_loaded')
+        load = {'a': 3, 'b': 0, 'c': 1}
+        for replica in router.replicas:
+            replica.in_use = load[replica.name]
+        self.assertEqual(router.choose().name, 'b')
+
+    def test_least_loaded_ties_take_turns(self):
+        router = ReplicaRouter(self.engines, selection='least_loaded')
+        self.assertEqual([router.choose().name for _ in range(3)],
+                         ['a', 'b', 'c'])
+
+    def test_unknown_selection(self):
+        with self.assertRaises(ValueError):
+            ReplicaRouter(self.engines, selection='random')
+
+
+if __name__ == "__main__":
+    unittest.main()
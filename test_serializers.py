@@ -0,0 +1,96 @@
+import datetime
+import json
+import unittest
+
+from flask import jsonify
+
+import app
+from models import db, Movie, Actor
+from serializers import JSONEncoder, orjson
+from test_models import ModelTestCase
+
+
+class ListResponseTestCase(ModelTestCase):
+    """Guards that the compiled serializers send what jsonify would"""
+
+    def setUp(self):
+        super().setUp()
+        self.app.json_encoder = JSONEncoder
+        self.add_movies(3)
+        db.session.add_all([
+            Actor(name='Zoë "Z" Saldaña', gender='female', age=None),
+            Movie(title=None, release_date=None)])
+        db.session.commit()
+
+    def list_body(self, model, key, query_string=''):
+        with self.app.test_request_context(f'/{key}?{query_string}'):
+            return app.list_response(model, key).get_data()
+
+    def jsonify_body(self, data):
+        with self.app.test_request_context():
+            return jsonify(data).get_data()
+
+    def test_full_listings_match_format_all(self):
+        for model, key in ((Movie, 'movies'), (Actor, 'actors')):
+            rows = model.query.order_by(model.id).all()
+            self.assertEqual(self.list_body(model, key), self.jsonify_body(
+                {'success': True, key: model.format_all(rows)}))
+
+    def test_listing_loads_no_orm_instances(self):
+        db.session.expunge_all()
+        self.list_body(Movie, 'movies')
+
+        self.assertEqual(len(db.session.identity_map), 0)
+
+    def test_selected_fields_and_cursor(self):
+        movies = Movie.query.order_by(Movie.id).limit(2).all()
+        expected = {
+            'success': True,
+            'movies': Movie.format_rows(movies, ['title', 'actors']),
+            'next_cursor': app.encode_cursor(movies[-1].id)
+        }
+
+        with self.app.test_request_context():
+            expected = jsonify(expected).get_data()
+        self.assertEqual(
+            self.list_body(Movie, 'movies', 'fields=title,actors&limit=2'),
+            expected)
+
+
+class JSONEncoderTestCase(unittest.TestCase):
+    """This class represents the JSON encoder test case"""
+
+    def encode(self, data, **kwargs):
+        return JSONEncoder(separators=(',', ':'), sort_keys=True,
+                           **kwargs).encode(data)
+
+    def test_dates_keep_the_http_date_format(self):
+        data = {'b': datetime.date(2002, 12, 4), 'a': [1, None, 'x']}
+
+        self.assertEqual(json.loads(self.encode(data)), {
+            'a': [1, None, 'x'], 'b': 'Wed, 04 Dec 2002 00:00:00 GMT'})
+        self.assertEqual(list(json.loads(self.encode(data))), ['a', 'b'])
+
+    def test_non_ascii_output_matches_the_standard_library(self):
+        data = {'name': 'Zoë "Z" Saldaña', 'ids': [1, 2]}
+
+        for ensure_ascii in (True, False):
+            self.assertEqual(
+                self.encode(data, ensure_ascii=ensure_ascii),
+                json.dumps(data, separators=(',', ':'), sort_keys=True,
+                           ensure_ascii=ensure_ascii))
+
+    def test_app_uses_the_encoder(self):
+        application = app.create_app(
+            {'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+
+        self.assertTrue(issubclass(application.json_encoder, JSONEncoder))
+
+    @unittest.skipIf(orjson is None, 'orjson is not installed')
+    def test_orjson_falls_back_on_large_integers(self):
+        self.assertEqual(self.encode({'n': 2 ** 70}),
+                         '{"n":%d}' % 2 ** 70)
+
+
+if __name__ == "__main__":
+    unittest.main()
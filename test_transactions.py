@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from flask import abort, jsonify
+from sqlalchemy import event
+
+from app import create_app
+from cache import response_cache
+from models import db, Actor
+
+
+class UnitOfWorkTestCase(unittest.TestCase):
+    """One commit per request, rolled back by error responses"""
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.path}'})
+        self.calls = []
+
+        @self.app.route('/test/actors/<int:count>', methods=['POST'])
+        def create_actors(count):
+            for i in range(count):
+                Actor(name=f'Actor {i}', gender='female', age=30).insert()
+            return jsonify({'success': True})
+
+        @self.app.route('/test/actors/invalid', methods=['POST'])
+        def create_invalid_actor():
+            Actor(name='Actor', gender='female', age=30).insert()
+            abort(422)
+
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.engine = db.get_engine(self.app)
+        event.listen(self.engine, 'commit', self.on_commit)
+
+        self.invalidate = response_cache.invalidate
+        response_cache.invalidate = lambda *namespaces: \
+            self.calls.append(('invalidate',) + namespaces)
+
+    def tearDown(self):
+        response_cache.invalidate = self.invalidate
+        event.remove(self.engine, 'commit', self.on_commit)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        os.remove(self.path)
+
+    def on_commit(self, connection):
+        self.calls.append(('commit',))
+
+    def test_commits_once_per_request(self):
+        res = self.app.test_client().post('/test/actors/3')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(Actor.query.count(), 3)
+        # the cache is invalidated once the writes are visible
+        self.assertEqual(self.calls, [('commit',), ('invalidate', 'actors')])
+
+    def test_error_response_rolls_back(self):
+        res = self.app.test_client().post('/test/actors/invalid')
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(Actor.query.count(), 0)
+        self.assertEqual(self.calls, [])
+
+    def test_commits_right_away_outside_requests(self):
+        Actor(name='Actor', gender='female', age=30).insert()
+
+        self.assertEqual(self.calls, [('commit',), ('invalidate', 'actors')])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,225 @@
+'''
+testing.py
+    hermetic test and benchmark harness: a local token issuer standing in
+    for the identity provider and an in-process database with per-test
+    rollback
+
+    issuer = LocalIssuer()
+    issuer.install()
+    database = TestDatabase()
+    client = database.app.test_client()
+    client.get('/movies', headers=issuer.headers('assistant'))
+
+    or, for a test case, subclass APITestCase
+'''
+import base64
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from jose import jwt
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+
+import auth
+from app import create_app
+from cache import response_cache
+from models import db
+
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL', 'sqlite://')
+
+ROLES = {
+    'assistant': ['get:movies', 'get:actors'],
+    'director': ['get:movies', 'get:actors', 'post:actors', 'patch:actors',
+                 'delete:actors', 'patch:movies'],
+    'executive': ['get:movies', 'get:actors', 'post:actors', 'patch:actors',
+                  'delete:actors', 'post:movies', 'patch:movies',
+                  'delete:movies']
+}
+
+
+def b64_uint(value):
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+class LocalIssuer:
+    '''
+    signs RS256 tokens with a key pair generated in process and serves the
+    matching key set, with the issuer and audience auth.py expects
+    '''
+
+    _key = None
+
+    def __init__(self, kid='local-test-key'):
+        # one key per process, generating it takes a few hundred ms
+        from Crypto.PublicKey import RSA
+
+        if LocalIssuer._key is None:
+            LocalIssuer._key = RSA.generate(2048)
+        self.key = LocalIssuer._key
+        self.kid = kid
+        self.private_pem = self.key.export_key('PEM').decode('ascii')
+        self._previous_fetcher = None
+
+    def jwks(self):
+        return {'keys': [{
+            'kty': 'RSA',
+            'kid': self.kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': b64_uint(self.key.n),
+            'e': b64_uint(self.key.e)
+        }]}
+
+    def jwks_url(self):
+        '''
+        the key set written to a temporary file, for JWKS_URL
+        '''
+        handle, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(handle, 'w') as jwks_file:
+            json.dump(self.jwks(), jwks_file)
+        return 'file://' + path
+
+    def token(self, role, expires_in=3600, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': f'https://{auth.AUTH0_DOMAIN}/',
+            'aud': auth.API_AUDIENCE,
+            'sub': f'local|{role}',
+            'iat': now,
+            'exp': now + expires_in,
+            'permissions': ROLES[role]
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def headers(self, role, **claims):
+        return {'Authorization': 'Bearer ' + self.token(role, **claims)}
+
+    def install(self):
+        '''
+        points the app's key store at this issuer instead of the identity
+        provider and forgets previously verified tokens
+        '''
+        self._previous_fetcher = auth.jwks_store.fetcher
+        auth.jwks_store.fetcher = self.jwks
+        auth.jwks_store.refresh()
+        auth.token_cache.clear()
+
+    def uninstall(self):
+        auth.jwks_store.fetcher = self._previous_fetcher
+        auth.token_cache.clear()
+
+
+class TestDatabase:
+    '''
+    an app from create_app() on TEST_DATABASE_URL (an in-memory sqlite
+    database by default) with the schema created once
+
+    begin() / rollback() wrap a test in a transaction on one connection:
+    the app's commits only release savepoints, what a request leaves
+    uncommitted is discarded when it ends, and rollback() discards
+    everything the test wrote
+    '''
+
+    # not a test case, despite the name
+    __test__ = False
+
+    def __init__(self, database_url=TEST_DATABASE_URL, **config):
+        config.setdefault('SQLALCHEMY_DATABASE_URI', database_url)
+        if database_url.startswith('sqlite'):
+            # one connection shared by every thread, so the in-memory
+            # database outlives the requests
+            config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+                'poolclass': StaticPool,
+                'connect_args': {'check_same_thread': False}
+            })
+        self.app = create_app(config)
+        self.engine = db.get_engine(self.app)
+        if self.engine.dialect.name == 'sqlite':
+            self._fix_sqlite_transactions()
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+        self._session = db.session
+        self.connection = None
+
+    def _fix_sqlite_transactions(self):
+        # let SQLAlchemy emit BEGIN itself so SAVEPOINTs work on pysqlite
+        @event.listens_for(self.engine, 'connect')
+        def do_connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(self.engine, 'begin')
+        def do_begin(connection):
+            connection.execute('BEGIN')
+
+        self.engine.dispose()
+
+    def begin(self):
+        self.connection = self.engine.connect()
+        self.transaction = self.connection.begin()
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
+        # outside an app context, whose teardown would remove the session
+        session = db.session()
+        session.begin_nested()
+
+        @event.listens_for(session, 'after_transaction_end')
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        # the app removes the session after every request, here that only
+        # rolls back to the last commit
+        db.session.remove = session.rollback
+        response_cache.invalidate('movies', 'actors')
+
+    def rollback(self):
+        db.session().close()
+        db.session = self._session
+        self.transaction.rollback()
+        self.connection.close()
+        self.connection = None
+        response_cache.invalidate('movies', 'actors')
+
+    def close(self):
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.engine.dispose()
+
+
+class APITestCase(unittest.TestCase):
+    '''
+    requests against the app of one TestDatabase per class with tokens of
+    a LocalIssuer; every test runs in a transaction rolled back after it,
+    self.headers carry a token of `role`
+    '''
+
+    role = 'executive'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.issuer = LocalIssuer()
+        cls.issuer.install()
+        cls.database = TestDatabase()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.database.close()
+        cls.issuer.uninstall()
+
+    def setUp(self):
+        self.database.begin()
+        self.client = self.database.app.test_client
+        self.headers = self.issuer.headers(self.role)
+
+    def tearDown(self):
+        self.database.rollback()
@@ -0,0 +1,58 @@
+'''
+transactions.py
+    one transaction per request instead of one commit per model call
+
+    The model helpers (insert, update, delete) and the bulk writes end with
+    unit_of_work.commit(namespaces). Inside a request that only flushes, so
+    ids and constraint errors are known to the view, and the request is
+    committed once after the view returned, followed by the invalidation
+    of the cached responses; an error response (abort(422) included) rolls
+    everything back instead. Outside a request, in scripts and the shell,
+    commit() commits right away as before.
+'''
+from flask import g, has_request_context
+
+from cache import response_cache
+
+
+class UnitOfWork:
+    def __init__(self, db, cache=response_cache):
+        self.db = db
+        self.cache = cache
+
+    def init_app(self, app):
+        app.before_request(self.begin)
+        app.after_request(self.end)
+
+    def begin(self):
+        # None until the request writes, then the namespaces to invalidate
+        g.unit_of_work = None
+
+    def active(self):
+        return has_request_context() and 'unit_of_work' in g
+
+    def commit(self, *namespaces):
+        if not self.active():
+            self.db.session.commit()
+            self.cache.invalidate(*namespaces)
+            return
+        self.db.session.flush()
+        self.invalidate(*namespaces)
+
+    def invalidate(self, *namespaces):
+        if not self.active():
+            self.cache.invalidate(*namespaces)
+            return
+        g.unit_of_work = (g.unit_of_work or set()) | set(namespaces)
+
+    def end(self, response):
+        namespaces = g.pop('unit_of_work', None)
+        if namespaces is None:
+            return response
+        if response.status_code >= 400:
+            self.db.session.rollback()
+            return response
+        # a failing commit raises, and the request ends with a 500
+        self.db.session.commit()
+        self.cache.invalidate(*namespaces)
+        return response